@@ -2,16 +2,54 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 import numpy as np
-import sys, os
+import sys, os, time
 
 import dice_utils as du
 import dnd_utils as dndu
+import sequence_utils as seq
+import batch_utils as bu
+import library_utils as lu
+import store_utils as su
+import graph_utils as gu
+import instrument_utils as iu
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 st.set_page_config(layout="wide")
 
 st.title("D&D Damage Calculator")
 
+# Enemy ACs / save DCs covered by the "DPR vs AC/DC" chart
+SWEEP_THRESHOLDS = np.arange(10, 26)
+# Folder the Library File panel loads from and saves to by default
+DEFAULT_LIBRARY_PATH = "action_library"
+# Most points plotted per action; wider distributions are thinned to every k-th outcome
+MAX_PLOT_POINTS = 400
+# Outcomes in either tail holding less probability than this in total are left off the charts
+PLOT_TAIL_TRIM = 1e-9
+# Tail mass pruned after each convolution of an action sequence; the total discarded is shown under the charts
+SEQUENCE_PRUNE_EPSILON = 1e-12
+# Action cards shown per page of the library grid
+CARDS_PER_PAGE = 25
+# Card button styling, emitted once per page; Streamlit tags each button's container with st-key-<key>
+CARD_CSS = """
+<style>
+div[class*="st-key-select_card_"] button {
+    background-color: #222222;
+    color: #EEE;
+    border: 1px solid #444;
+    border-radius: 8px;
+    padding: 12px;
+    margin-bottom: 8px;
+    text-align: left;
+    white-space: pre-wrap;
+}
+div[class*="st-key-select_card_"] button[kind="primary"] {
+    background-color: #0068C9;
+    color: #FFF;
+}
+</style>
+"""
+
 # --- Session State Initialization ---
 def init_session_state(key, default):
     if key not in st.session_state:
@@ -19,6 +57,20 @@ def init_session_state(key, default):
 
 init_session_state('action_library', {})
 init_session_state('editing_action_name', None)
+init_session_state('sequence_engine', seq.SequenceEngine(SEQUENCE_PRUNE_EPSILON))
+init_session_state('action_graph', gu.ActionGraph())
+# PMFs of the loaded library, memory-mapped and only read when an action is plotted
+init_session_state('action_store', su.PMFStore.empty())
+init_session_state('builds', {})
+init_session_state('build_results', None)
+init_session_state('debug_profiling', False)
+
+# --- Profiling (shown in the sidebar's Debug panel) ---
+# Collection is per thread, so profiling one session's reruns never touches another's
+iu.stop()
+if st.session_state.debug_profiling:
+    iu.start()
+rerun_start = time.perf_counter()
 
 # --- Decorated Edit Dialog ---
 @st.dialog("Edit Action")
@@ -44,8 +96,8 @@ def edit_action_dialog(action_name):
                         value=action.get('enemy_ac', 15),
                         key="enemy_ac_edit")
         st.radio("Resistance/Vulnerability",
-                 ["Neither", "Resistant", "Vulnerable"],
-                 index=["Neither", "Resistant", "Vulnerable"]
+                 list(du.RESISTANCE_STEPS),
+                 index=list(du.RESISTANCE_STEPS)
                        .index(action.get('enemy_resistance', 'Neither')),
                  horizontal=True,
                  key="enemy_resistance_edit")
@@ -77,8 +129,8 @@ def edit_action_dialog(action_name):
                         value=action.get('save_dc', 15),
                         key="save_dc_edit")
         st.radio("Resistance/Vulnerability",
-                 ["Neither", "Resistant", "Vulnerable"],
-                 index=["Neither", "Resistant", "Vulnerable"]
+                 list(du.RESISTANCE_STEPS),
+                 index=list(du.RESISTANCE_STEPS)
                        .index(action.get('save_resistance', 'Neither')),
                  horizontal=True,
                  key="save_resistance_edit")
@@ -146,7 +198,8 @@ with st.sidebar.expander("**Dice String Syntax**"):
             """- **Dice:** `1d20`, `2d6+3`
 - **Advantage/Disadvantage/Elven Accuracy:** `adv(1d20)`, `disadv(1d20)` , `ea(1d20)`
 - **Reroll:** `2d6r1`
-- **Minimum:** `2d6m3`"""
+- **Minimum:** `2d6m3`
+- **Keep highest/lowest:** `4d6kh3`, `2d20kl1`"""
             )
 with st.sidebar.expander("New Action", expanded=True):
     action_type = st.radio("Action Type",
@@ -200,7 +253,7 @@ with st.sidebar.expander("New Action", expanded=True):
                       key="attack_roll_string")
         st.number_input("Enemy AC", 1, 30, 15, key="enemy_ac")
         st.radio("Resistance/Vulnerability",
-                 ["Neither","Resistant","Vulnerable"],
+                 list(du.RESISTANCE_STEPS),
                  horizontal=True, key="enemy_resistance")
         st.text_input("Damage (on hit)", "1d8+3", key="dmg_string")
         st.number_input("Crit on d20 roll of...", 1, 20, 20, key="crit_range")
@@ -217,7 +270,7 @@ with st.sidebar.expander("New Action", expanded=True):
                       key="save_roll_string")
         st.number_input("Saving Throw DC", 1, 30, 15, key="save_dc")
         st.radio("Resistance/Vulnerability",
-                 ["Neither","Resistant","Vulnerable"],
+                 list(du.RESISTANCE_STEPS),
                  horizontal=True, key="save_resistance")
         st.checkbox("Target has Evasion", key="has_evasion")
         st.text_input("Damage on Failed Save", "8d6",
@@ -232,42 +285,42 @@ with st.sidebar.expander("New Action", expanded=True):
     st.text_input("Action Name", key="new_action_name")
     st.button("Save Action", on_click=save_new_action, key="save_new_btn")
 
+# --- Sidebar: Library File ---
+with st.sidebar.expander("Library File"):
+    st.text_input("Library Folder", DEFAULT_LIBRARY_PATH, key="library_path")
+
+    def load_library_file():
+        try:
+            library, store = su.load_library(st.session_state.library_path)
+        except (OSError, ValueError) as e:
+            st.sidebar.error(f"Could not load library: {e}")
+            return
+        st.session_state.action_library = library
+        st.session_state.action_store = store
+        st.sidebar.success(f"Loaded {len(library)} actions")
+
+    def save_library_file():
+        try:
+            su.save_library(st.session_state.library_path, st.session_state.action_library,
+                            st.session_state.action_store)
+        except OSError as e:
+            st.sidebar.error(f"Could not save library: {e}")
+            return
+        st.sidebar.success(f"Saved {len(st.session_state.action_library)} actions")
+
+    l1, l2 = st.columns(2)
+    l1.button("Load", on_click=load_library_file, key="load_library_btn")
+    l2.button("Save", on_click=save_library_file, key="save_library_btn")
+
 # --- Main Panel ---
 mode1, mode2, mode3 = st.tabs([
     "Action Library", "Action Sequences", "Build Comparisons"
 ])
 
 with mode1:
-    # 1) Compute DPR (average damage) for each saved action
-    action_dprs = {}
-    for name, params in st.session_state.action_library.items():
-        pmf = {}
-        if params['action_type'] == "Dice Roll":
-            pmf = du.parse_and_calculate_pmf(params['dice_roll_string'])
-        elif params['action_type'] == "Attack Roll":
-            crit_expr = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
-            pmf = dndu.get_full_damage_distribution(
-                d20_string=params['attack_roll_string'],
-                ac=params['enemy_ac'],
-                crit_range=[params['crit_range'], 20],
-                on_hit_pmf_expr=params['dmg_string'],
-                on_miss_damage=params['dmg_on_miss'],
-                on_crit_pmf_expr=crit_expr
-            )
-            pmf = du.apply_resistance_vulnerability(pmf, params['enemy_resistance'])
-        else:  # Saving Throw
-            succ_expr = params.get('succ_dmg_string') if params.get('save_success_behavior') == "Custom" else ""
-            pmf = dndu.get_save_damage_distribution(
-                save_dc=params['save_dc'],
-                save_roll_string=params['save_roll_string'],
-                on_fail_pmf_expr=params['fail_dmg_string'],
-                on_succeed_pmf_expr=succ_expr,
-                save_success_behavior=params['save_success_behavior'],
-                has_evasion=params['has_evasion']
-            )
-            pmf = du.apply_resistance_vulnerability(pmf, params['save_resistance'])
-
-        action_dprs[name] = np.sum([d * p for d, p in pmf.items()]) if pmf else 0
+    # 1) Compute DPR (average damage) for each saved action from its analytic moments;
+    #    full PMFs are only built (and cached) for the actions that get plotted
+    action_dprs = lu.compute_action_dprs(st.session_state.action_library)
 
     # 2) Plotting pane (only if user has selected at least one card)
     selected = {
@@ -276,41 +329,13 @@ with mode1:
         if st.session_state.get(f"action_select_{n}", False)
     }
 
-    if selected:
-        dfs = []
-        for name, params in selected.items():
-            if params['action_type'] == "Dice Roll":
-                pmf = du.parse_and_calculate_pmf(params['dice_roll_string'])
-            elif params['action_type'] == "Attack Roll":
-                crit_expr = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
-                pmf = dndu.get_full_damage_distribution(
-                    d20_string=params['attack_roll_string'],
-                    ac=params['enemy_ac'],
-                    crit_range=[params['crit_range'], 20],
-                    on_hit_pmf_expr=params['dmg_string'],
-                    on_miss_damage=params['dmg_on_miss'],
-                    on_crit_pmf_expr=crit_expr
-                )
-                pmf = du.apply_resistance_vulnerability(pmf, params['enemy_resistance'])
-            else:
-                succ_expr = params.get('succ_dmg_string') if params.get('save_success_behavior') == "Custom" else ""
-                pmf = dndu.get_save_damage_distribution(
-                    save_dc=params['save_dc'],
-                    save_roll_string=params['save_roll_string'],
-                    on_fail_pmf_expr=params['fail_dmg_string'],
-                    on_succeed_pmf_expr=succ_expr,
-                    save_success_behavior=params['save_success_behavior'],
-                    has_evasion=params['has_evasion']
-                )
-                pmf = du.apply_resistance_vulnerability(pmf, params['save_resistance'])
-
-            df = pd.DataFrame(pmf.items(), columns=["Damage", "Probability"])
-            df["Action"] = name
-            dfs.append(df)
-
-        plot_df = pd.concat(dfs)
-           # … after building plot_df …
+    # Plotted PMFs come from the session's action graph, so after an edit only the
+    # edited action's changed nodes are rebuilt; deleted actions release theirs here
+    action_graph = st.session_state.action_graph
+    action_graph.store = st.session_state.action_store
+    action_graph.sync(st.session_state.action_library)
 
+    if selected:
         # Plot options row
         c1, c2, c3 = st.columns([1, 2, 1])
         with c1:
@@ -318,7 +343,7 @@ with mode1:
         with c2:
             plot_type = st.radio(
                 "Plot Type",
-                ["Probability (PMF)", "Minimum Damage Probability"],
+                ["Probability (PMF)", "Minimum Damage Probability", "DPR vs AC/DC"],
                 horizontal=True,
                 key="plot_type",
                 label_visibility="collapsed"
@@ -326,37 +351,82 @@ with mode1:
         with c3:
             show_avg = st.checkbox("Show Average Lines", True)
 
-        base = alt.Chart(plot_df)
+        # The PMF frame is only built for the charts that plot it; the sweep chart has its own
+        if plot_type != "DPR vs AC/DC":
+            plot_df = lu.build_plot_df(selected, MAX_PLOT_POINTS, PLOT_TAIL_TRIM, action_graph.action_pmf)
 
         if plot_type == "Probability (PMF)":
-            chart = base.mark_bar().encode(
+            chart = alt.Chart(plot_df[["Damage", "Probability", "Action"]]).mark_bar().encode(
                 x=alt.X("Damage:Q", axis=alt.Axis(tickMinStep=1, grid=False)),
                 y=alt.Y("Probability:Q", axis=alt.Axis(format="%")),
                 color="Action:N",
                 tooltip=["Action", "Damage", alt.Tooltip("Probability", format=".2%")],
             ).properties(height=400).interactive()
 
-        else:  # Minimum Damage Probability
-            # — your original CDF/min‐damage code preserved here —
-            min_dmg_df = plot_df.sort_values("Damage").reset_index(drop=True)
-            min_dmg_df["CDF"] = (
-                min_dmg_df.groupby("Action")["Probability"].cumsum()
-            )
-            min_dmg_df["MinDamageProb"] = (
-                1
-                - min_dmg_df["CDF"]
-                + min_dmg_df["Probability"]
-            )
-            # only positive damage points
-            min_dmg_df = min_dmg_df[min_dmg_df["Damage"] > 0]
-            # build a custom tooltip string
-            min_dmg_df["tooltip_text"] = min_dmg_df.apply(
-                lambda row: f"{row['MinDamageProb']:.1%} chance for at least {row['Damage']} damage",
-                axis=1,
+        elif plot_type == "DPR vs AC/DC":
+            # One sweep per action: attacks across enemy AC, saving throws across save DC
+            sweep_dfs = []
+            for name, params in selected.items():
+                if params['action_type'] == "Attack Roll":
+                    crit_expr = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
+                    sweep = dndu.sweep_attack_damage(
+                        d20_string=params['attack_roll_string'],
+                        acs=SWEEP_THRESHOLDS,
+                        crit_range=[params['crit_range'], 20],
+                        on_hit_pmf_expr=params['dmg_string'],
+                        on_miss_damage=params['dmg_on_miss'],
+                        on_crit_pmf_expr=crit_expr,
+                        resistance_type=params['enemy_resistance']
+                    )
+                elif params['action_type'] == "Saving Throw":
+                    succ_expr = params.get('succ_dmg_string') if params.get('save_success_behavior') == "Custom" else ""
+                    sweep = dndu.sweep_save_damage(
+                        save_dcs=SWEEP_THRESHOLDS,
+                        save_roll_string=params['save_roll_string'],
+                        on_fail_pmf_expr=params['fail_dmg_string'],
+                        on_succeed_pmf_expr=succ_expr,
+                        save_success_behavior=params['save_success_behavior'],
+                        has_evasion=params['has_evasion'],
+                        resistance_type=params['save_resistance']
+                    )
+                else:  # Dice Rolls have no target to sweep
+                    continue
+                sweep_dfs.append(pd.DataFrame({
+                    "Target": sweep.thresholds,
+                    "DPR": sweep.means,
+                    "StdDev": np.sqrt(sweep.variances),
+                    "Action": name,
+                }))
+
+            sweep_df = pd.concat(sweep_dfs) if sweep_dfs else pd.DataFrame(columns=["Target", "DPR", "StdDev", "Action"])
+            chart = (
+                alt.Chart(sweep_df)
+                .mark_line(point=True)
+                .encode(
+                    x=alt.X("Target:Q", title="Enemy AC / Save DC", axis=alt.Axis(tickMinStep=1)),
+                    y=alt.Y("DPR:Q", title="Average Damage"),
+                    color="Action:N",
+                    tooltip=[
+                        "Action",
+                        alt.Tooltip("Target:Q", title="AC / DC"),
+                        alt.Tooltip("DPR:Q", title="Average Damage", format=".2f"),
+                        alt.Tooltip("StdDev:Q", title="Std. Dev.", format=".2f"),
+                    ],
+                )
+                .properties(height=400)
+                .interactive()
             )
 
+        else:  # Minimum Damage Probability
+            # P(Damage >= X) comes precomputed; only positive damage points are shown
+            min_dmg_df = plot_df.loc[plot_df["Damage"] > 0, ["Damage", "MinDamageProb", "Action"]]
+
             chart = (
                 alt.Chart(min_dmg_df)
+                # The tooltip text is built in the browser rather than shipped per row
+                .transform_calculate(
+                    tooltip_text="format(datum.MinDamageProb, '.1%') + ' chance for at least ' + datum.Damage + ' damage'"
+                )
                 .mark_line(point=True)
                 .encode(
                     x=alt.X("Damage:Q", scale=alt.Scale(zero=False)),
@@ -373,12 +443,8 @@ with mode1:
             )
 
         # overlay average‐damage rule if desired
-        if show_avg:
-            avg_df = (
-                plot_df.groupby("Action")
-                .apply(lambda g: pd.Series({"avg": (g["Damage"] * g["Probability"]).sum()}))
-                .reset_index()
-            )
+        if show_avg and plot_type != "DPR vs AC/DC":
+            avg_df = lu.build_average_df(selected, action_graph.action_pmf)
             avg_rule = (
                 alt.Chart(avg_df)
                 .mark_rule(strokeDash=[4, 4])
@@ -393,60 +459,44 @@ with mode1:
             )
             chart = alt.layer(chart, avg_rule)
 
-        st.altair_chart(chart, use_container_width=True)
+        with iu.phase("app.altair_chart"):
+            st.altair_chart(chart, use_container_width=True)
 
     else:
         st.info("Select one or more actions below to plot their distributions. To create new actions, use side panel.")
 
-    # 3) Search & Sort
-    search = st.text_input("Search Actions", key="search_actions")
-    s1, s2 = st.columns([3, 2])
+    # 3) Search & Sort (a new search starts again from the first page)
+    search = st.text_input("Search Actions", key="search_actions",
+                           on_change=lambda: st.session_state.update(card_page=1))
+    s1, s2, s3 = st.columns([3, 2, 1])
     with s1:
         sort_by = st.selectbox("Sort by", ["Name", "Average Damage"], key="sort_by")
     with s2:
         order = st.radio("Order", ["Ascending", "Descending"], horizontal=True, key="sort_order")
 
-    # 4) Styled Card Grid (5 across)
-    filtered = {
-        n: p
-        for n, p in st.session_state.action_library.items()
-        if search.lower() in n.lower()
-    }
-    names = sorted(
-        filtered.keys(),
-        key=lambda n: (action_dprs[n] if sort_by == "Average Damage" else n),
-        reverse=(order == "Descending"),
-    )
-
-    for i in range(0, len(names), 5):
+    names = lu.order_action_names(action_dprs, search, sort_by == "Average Damage", order == "Descending")
+    n_pages = max(1, -(-len(names) // CARDS_PER_PAGE))
+    if st.session_state.get("card_page", 1) > n_pages:
+        st.session_state.card_page = n_pages
+    with s3:
+        page = st.number_input("Page", 1, n_pages, key="card_page")
+    first = (page - 1) * CARDS_PER_PAGE
+    page_names = names[first:first + CARDS_PER_PAGE]
+    if names:
+        st.caption(f"Showing {first + 1}–{first + len(page_names)} of {len(names)} actions")
+
+    # 4) Styled Card Grid (5 across), one page at a time; selected cards are primary buttons
+    st.markdown(CARD_CSS, unsafe_allow_html=True)
+    for i in range(0, len(page_names), 5):
         cols = st.columns(5)
-        for j, name in enumerate(names[i : i + 5]):
-            params = filtered[name]
+        for j, name in enumerate(page_names[i : i + 5]):
+            params = st.session_state.action_library[name]
             avg = action_dprs.get(name, 0)
             is_sel = st.session_state.get(f"action_select_{name}", False)
-            bg = "#0068C9" if is_sel else "#222222"
-            fg = "#FFF" if is_sel else "#EEE"
-
-            # Per-card CSS to style only this column’s button
-            css = f"""
-            <style>
-            div[data-testid="stVerticalBlock"] > div:nth-child({j+1}) > div > button[data-testid^="stButton"] {{
-                background-color: {bg};
-                color: {fg};
-                border: 1px solid #444;
-                border-radius: 8px;
-                padding: 12px;
-                margin-bottom: 8px;
-                text-align: left;
-                white-space: pre-wrap;
-            }}
-            </style>
-            """
-            cols[j].markdown(css, unsafe_allow_html=True)
 
             # Main card button with multiline label
             label = f"**{name}**\n\n*{params['action_type']}*  Avg: **{avg:.2f}**"
-            if cols[j].button(label, key=f"select_card_{name}"):
+            if cols[j].button(label, key=f"select_card_{name}", type="primary" if is_sel else "secondary"):
                 st.session_state[f"action_select_{name}"] = not is_sel
                 st.rerun()
 
@@ -467,8 +517,167 @@ with mode1:
 
 with mode2:
     st.header("Action Sequences")
-    st.info("Under construction.")
+    library = st.session_state.action_library
+
+    if not library:
+        st.info("Save actions to the library first. To create new actions, use side panel.")
+    else:
+        # 1) Build one turn out of saved actions, each used some number of times
+        turn_names = st.multiselect("Actions per turn", list(library), key="sequence_actions")
+        turn = []
+        if turn_names:
+            count_cols = st.columns(min(len(turn_names), 5))
+            for i, name in enumerate(turn_names):
+                count = count_cols[i % 5].number_input(f"{name} ×", 1, 20, 1, key=f"sequence_count_{name}")
+                turn.append((library[name], count))
+        r1, r2 = st.columns(2)
+        n_rounds = r1.number_input("Rounds", 1, 20, 3, key="sequence_rounds")
+        target_hp = r2.number_input("Target HP", 1, 10000, 120, key="sequence_target_hp")
+
+        # 2) Cumulative damage after each round
+        if turn:
+            totals = st.session_state.sequence_engine.round_totals(turn, n_rounds)
+            final_pmf = totals[-1]
+            final_mean = final_pmf.mean()
+            final_std = np.sqrt(max(np.dot((final_pmf.outcomes() - final_mean) ** 2, final_pmf.probs), 0))
+
+            kill_probs = st.session_state.sequence_engine.kill_probabilities(turn, target_hp, n_rounds)
+
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Average per Turn", f"{totals[0].mean():.2f}")
+            m2.metric(f"Average over {n_rounds} Rounds", f"{final_mean:.2f}")
+            m3.metric("Standard Deviation", f"{final_std:.2f}")
+            m4.metric(f"P(≤ 0 HP by Round {n_rounds})", f"{kill_probs[-1]:.1%}")
+
+            p1, p2 = st.columns(2)
+            with p1:
+                rounds_df = pd.DataFrame({
+                    "Round": np.arange(1, n_rounds + 1),
+                    "Average Damage": [pmf.mean() for pmf in totals],
+                })
+                st.altair_chart(
+                    alt.Chart(rounds_df).mark_line(point=True).encode(
+                        x=alt.X("Round:Q", axis=alt.Axis(tickMinStep=1)),
+                        y=alt.Y("Average Damage:Q", title="Cumulative Average Damage"),
+                        tooltip=["Round", alt.Tooltip("Average Damage", format=".2f")],
+                    ).properties(height=400),
+                    use_container_width=True
+                )
+            with p2:
+                total_df = pd.DataFrame(final_pmf.items(), columns=["Damage", "Probability"])
+                st.altair_chart(
+                    alt.Chart(total_df).mark_bar().encode(
+                        x=alt.X("Damage:Q", title=f"Total Damage after {n_rounds} Rounds", axis=alt.Axis(grid=False)),
+                        y=alt.Y("Probability:Q", axis=alt.Axis(format="%")),
+                        tooltip=["Damage", alt.Tooltip("Probability", format=".2%")],
+                    ).properties(height=400).interactive(),
+                    use_container_width=True
+                )
+            if final_pmf.error:
+                st.caption(f"Tails below {SEQUENCE_PRUNE_EPSILON:g} were pruned; at most {final_pmf.error:.1e} "
+                           "of the probability has been moved.")
+
+            # 3) Chance the target has dropped by the end of each round
+            kill_df = pd.DataFrame({"Round": np.arange(1, n_rounds + 1), "Kill Probability": kill_probs})
+            st.altair_chart(
+                alt.Chart(kill_df).mark_line(point=True).encode(
+                    x=alt.X("Round:Q", axis=alt.Axis(tickMinStep=1)),
+                    y=alt.Y("Kill Probability:Q", title=f"P(Target with {target_hp} HP Down)",
+                            axis=alt.Axis(format="%"), scale=alt.Scale(domain=[0, 1])),
+                    tooltip=["Round", alt.Tooltip("Kill Probability", format=".2%")],
+                ).properties(height=300),
+                use_container_width=True
+            )
+        else:
+            st.info("Select the actions that make up one turn.")
 
 with mode3:
     st.header("Build Comparisons")
-    st.info("Under construction.")
+    library = st.session_state.action_library
+
+    if not library:
+        st.info("Save actions to the library first. To create new actions, use side panel.")
+    else:
+        # 1) Define builds: each one a set of saved actions used in a turn
+        with st.expander("New Build", expanded=not st.session_state.builds):
+            build_names = st.multiselect("Actions in build", list(library), key="build_actions")
+            if build_names:
+                count_cols = st.columns(min(len(build_names), 5))
+                for i, name in enumerate(build_names):
+                    count_cols[i % 5].number_input(f"{name} ×", 1, 20, 1, key=f"build_count_{name}")
+
+            def save_new_build():
+                name = st.session_state.new_build_name.strip()
+                if not name or not st.session_state.build_actions:
+                    st.warning("Enter a build name and pick at least one action.")
+                    return
+                st.session_state.builds[name] = [
+                    (action, st.session_state.get(f"build_count_{action}", 1))
+                    for action in st.session_state.build_actions
+                ]
+                st.session_state.new_build_name = ""
+
+            st.text_input("Build Name", key="new_build_name")
+            st.button("Save Build", on_click=save_new_build, key="save_build_btn")
+
+        if not st.session_state.builds:
+            st.info("Save one or more builds to compare them.")
+        else:
+            # 2) Target matrix and evaluation options
+            compared = st.multiselect("Builds to compare", list(st.session_state.builds),
+                                      default=list(st.session_state.builds), key="compared_builds")
+            t1, t2 = st.columns(2)
+            with t1:
+                ac_range = st.slider("Enemy AC", 1, 30, (12, 20), key="compare_ac_range")
+                damage_threshold = st.number_input("Show P(Damage ≥ X) for X =", 0, value=20, key="compare_threshold")
+            with t2:
+                resistances = st.multiselect("Resistance/Vulnerability", list(du.RESISTANCE_STEPS),
+                                             default=["Neither"], key="compare_resistances")
+                workers = st.number_input("Worker processes (0 = all cores, 1 = serial)", 0, 64, 1, key="compare_workers")
+
+            if st.button("Compare Builds", key="compare_builds_btn"):
+                keys, pairs = [], []
+                for build_name in compared:
+                    build = [(library[a], n) for a, n in st.session_state.builds[build_name] if a in library]
+                    for ac in range(ac_range[0], ac_range[1] + 1):
+                        for resistance in resistances:
+                            keys.append({"Build": build_name, "AC": ac, "Resistance": resistance})
+                            pairs.append((build, {'ac': ac, 'resistance': resistance}))
+                summaries = bu.evaluate_builds(pairs, damage_thresholds=[damage_threshold],
+                                               max_workers=workers or None)
+                st.session_state.build_results = pd.DataFrame(
+                    [{**key, **summary} for key, summary in zip(keys, summaries)]
+                )
+
+            # 3) Results
+            results = st.session_state.build_results
+            if results is not None and not results.empty:
+                chart = (
+                    alt.Chart(results)
+                    .mark_line(point=True)
+                    .encode(
+                        x=alt.X("AC:Q", title="Enemy AC", axis=alt.Axis(tickMinStep=1)),
+                        y=alt.Y("mean:Q", title="Average Damage"),
+                        color="Build:N",
+                        strokeDash="Resistance:N",
+                        tooltip=["Build", "AC", "Resistance",
+                                 alt.Tooltip("mean:Q", title="Average Damage", format=".2f"),
+                                 alt.Tooltip("std:Q", title="Std. Dev.", format=".2f")],
+                    )
+                    .properties(height=400)
+                    .interactive()
+                )
+                st.altair_chart(chart, use_container_width=True)
+                st.dataframe(results, use_container_width=True, hide_index=True)
+
+# --- Sidebar: Debug ---
+with st.sidebar.expander("Debug"):
+    st.checkbox("Profile reruns", key="debug_profiling",
+                help="Call counts, wall time and PMF support sizes of the engine's hot paths for this rerun")
+    if st.session_state.debug_profiling:
+        iu.record("app.rerun", time.perf_counter() - rerun_start)
+        profile = pd.DataFrame(iu.stop(), columns=["name", "calls", "total_ms", "max_ms", "max_support"])
+        st.dataframe(profile, hide_index=True, use_container_width=True)
+        graph = st.session_state.action_graph.info()
+        st.caption(f"Action graph: {graph['nodes']} nodes for {graph['actions']} actions, "
+                   f"{graph['computed']} computed / {graph['reused']} reused")
@@ -0,0 +1,181 @@
+"""Benchmark suite for the damage engine and the Action Library compute path.
+
+Usage:
+    python benchmark.py                              # run everything, write benchmark_results.json
+    python benchmark.py --filter attack              # only benchmarks whose name contains "attack"
+    python benchmark.py --save-baseline              # store the results as the new baseline
+    python benchmark.py --baseline bench_base.json   # compare against a saved baseline
+
+Exits with status 1 if any benchmark's median is slower than the baseline by more than
+--tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import batch_utils as bu
+import dice_utils as du
+import dnd_utils as dndu
+import graph_utils as gu
+import library_utils as lu
+
+DEFAULT_OUTPUT = "benchmark_results.json"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# --- Workloads ---
+
+ATTACK = {
+    'action_type': "Attack Roll", 'attack_roll_string': "1d20+7", 'enemy_ac': 16,
+    'enemy_resistance': "Neither", 'dmg_string': "1d8+4", 'crit_range': 20,
+    'use_custom_crit': False, 'custom_crit_string': None, 'dmg_on_miss': 0,
+}
+SAVE = {
+    'action_type': "Saving Throw", 'save_roll_string': "1d20+3", 'save_dc': 15,
+    'save_resistance': "Neither", 'has_evasion': False, 'fail_dmg_string': "8d6",
+    'save_success_behavior': "Half Damage", 'succ_dmg_string': None,
+}
+
+def make_library(size):
+    """A varied library of attacks, saves and plain rolls, like a large saved action list."""
+    library = {}
+    for i in range(size):
+        kind = i % 3
+        if kind == 0:
+            params = dict(ATTACK, attack_roll_string=["1d20+7", "adv(1d20)+5+1d4", "disadv(1d20)+9"][i // 3 % 3],
+                          enemy_ac=10 + i % 16, dmg_string=f"{1 + i % 4}d{[6, 8, 10, 12][i % 4]}+{i % 6}",
+                          crit_range=19 + i % 2, enemy_resistance=["Neither", "Resistant", "Vulnerable"][i % 3])
+        elif kind == 1:
+            params = dict(SAVE, save_dc=10 + i % 10, fail_dmg_string=f"{2 + i % 18}d{[6, 8, 10][i % 3]}",
+                          has_evasion=bool(i % 5 == 0), save_resistance=["Neither", "Resistant"][i % 2])
+        else:
+            params = {'action_type': "Dice Roll", 'dice_roll_string': f"{1 + i % 6}d{[4, 6, 8][i % 3]}r1+{i % 4}"}
+        library[f"Action {i}"] = params
+    return library
+
+def _cold(fn, *resets):
+    """Wraps fn so every repeat starts with empty parse/PMF caches (and anything in resets cleared)."""
+    def run():
+        du.clear_caches()
+        dndu.clear_caches()
+        for reset in resets: reset()
+        return fn()
+    return run
+
+def benchmarks():
+    """Name -> zero-argument callable. Names prefixed 'cold' clear every cache first."""
+    small_pmf = du.parse_and_calculate_pmf("1d8+3")
+    large_pmf = du.parse_and_calculate_pmf("100d6")
+    die = du.get_pmf_for_die(6)
+    library = make_library(500)
+    selected = {name: library[name] for name in list(library)[:5]}
+    graph = gu.ActionGraph()
+
+    def app_rerun():
+        # The Action Library tab's path: ranking from moments, plotted PMFs through the action graph
+        dprs = lu.compute_action_dprs(library)
+        lu.order_action_names(dprs, by_average=True)
+        graph.sync(library)
+        lu.build_plot_df(selected, 400, 1e-9, graph.action_pmf)  # app.py's MAX_PLOT_POINTS, PLOT_TAIL_TRIM
+
+    cases = {
+        # Parser
+        'parse_small': lambda: du.parse_and_calculate_pmf("2d6r1+1d4+5"),
+        'parse_large_pool': lambda: du.parse_and_calculate_pmf("40d6+20d10"),
+        'parse_keep_highest': lambda: du.parse_and_calculate_pmf("8d6kh4"),
+        # Convolution
+        'convolve_small': lambda: du.convolve_pmfs(small_pmf, small_pmf),
+        'convolve_large': lambda: du.convolve_pmfs(large_pmf, large_pmf),
+        'autoconvolve_40d6': lambda: du.autoconvolve_pmf(die, 40),
+        'autoconvolve_100d6': lambda: du.autoconvolve_pmf(die, 100),
+        # Attack / save distributions
+        'attack_basic': lambda: dndu.get_full_damage_distribution("1d20+7", 16, [20, 20], "1d8+4", 0, ""),
+        'attack_bless_crit19': lambda: dndu.get_full_damage_distribution("adv(1d20)+5+1d4", 16, [19, 20], "2d6+5+1d8", 0, ""),
+        'save_fireball': lambda: dndu.get_save_damage_distribution(15, "1d20+3", "8d6", "", "Half Damage", False),
+        'save_fireball_20d10_evasion': lambda: dndu.get_save_damage_distribution(17, "1d20+5+1d4", "20d10", "", "Half Damage", True),
+        'sweep_attack_ac10_25': lambda: dndu.sweep_attack_damage("1d20+7", np.arange(10, 26), [19, 20], "2d6+5", 0, ""),
+        'attack_cube_serial': lambda: bu.sweep_attack_cube("2d6+5+1d8", range(13), range(10, 26), max_workers=1),
+        'turn_sneak_attack_8_attacks': lambda: dndu.get_turn_damage_distribution([ATTACK] * 8, "5d6"),
+        # Action Library compute path (no Streamlit server)
+        'app_rerun_500_actions': app_rerun,
+    }
+    for name in list(cases):
+        if name.startswith(('parse', 'attack', 'save', 'app')):
+            cases[f'cold_{name}'] = _cold(cases[name], graph.clear)
+    return cases
+
+# --- Runner ---
+
+def time_case(fn, repeat, min_time=0.05):
+    """Median and min seconds per call, looping each sample until it takes at least min_time."""
+    fn()  # warm-up
+    loops, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops): fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 16: break
+        loops *= 2
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops): fn()
+        samples.append((time.perf_counter() - start) / loops)
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'loops': loops, 'repeat': repeat}
+
+def compare(results, baseline, tolerance):
+    """Names of benchmarks whose median regressed by more than tolerance against the baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None: continue
+        ratio = result['median_s'] / base['median_s']
+        result['baseline_ratio'] = ratio
+        if ratio > 1 + tolerance: regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=None, help=f"baseline JSON to compare against, or to write with --save-baseline (default: {DEFAULT_BASELINE})")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--filter', default="")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before flagging a regression (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    # Checked up front so a mistyped path fails before the benchmarks run, not after
+    if args.baseline and not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"baseline file not found: {args.baseline}")
+
+    results = {}
+    for name, fn in benchmarks().items():
+        if args.filter not in name: continue
+        results[name] = time_case(fn, args.repeat)
+        print(f"{name:<36} {results[name]['median_s'] * 1e3:10.3f} ms")
+
+    regressions = []
+    if not args.save_baseline:
+        try:
+            with open(args.baseline or DEFAULT_BASELINE) as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+        except FileNotFoundError:
+            pass  # no default baseline saved yet
+    for name in regressions:
+        print(f"REGRESSION: {name} is {results[name]['baseline_ratio']:.2f}x the baseline", file=sys.stderr)
+
+    report = {'python': platform.python_version(), 'numpy': np.__version__,
+              'machine': platform.machine(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline or DEFAULT_BASELINE, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
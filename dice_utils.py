@@ -1,94 +1,519 @@
+import math
 import re
+import threading
+from collections import OrderedDict, namedtuple
+from fractions import Fraction
+from functools import lru_cache
 import numpy as np
+import instrument_utils as iu
+
+class PMF:
+    """A probability mass function stored as an integer offset plus a contiguous float array.
+
+    probs[i] is the probability of outcome offset + i. The read-only dict methods
+    (items, keys, values, get, ...) are kept so callers written against the old
+    dict-of-floats PMFs keep working unchanged. error bounds the total probability
+    moved by tail pruning (see prune_pmf) anywhere in the PMF's history; it is 0 for
+    exact results.
+    """
+    __slots__ = ('offset', 'probs', 'error')
+
+    def __init__(self, offset, probs, error=0.0):
+        self.offset = int(offset)
+        self.probs = np.ascontiguousarray(probs, dtype=np.float64)
+        self.error = float(error)
+
+    @classmethod
+    def point(cls, value, prob=1.0):
+        """A PMF with all of its mass on a single outcome."""
+        return cls(value, [prob])
+
+    @classmethod
+    def from_dict(cls, pmf):
+        """Packs a {outcome: probability} dict into a PMF."""
+        if not pmf: return cls(0, [])
+        lo, hi = min(pmf), max(pmf)
+        probs = np.zeros(hi - lo + 1)
+        for outcome, prob in pmf.items():
+            probs[outcome - lo] += prob
+        return cls(lo, probs)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def outcomes(self):
+        return np.arange(self.offset, self.offset + len(self.probs))
+
+    @property
+    def max_outcome(self):
+        return self.offset + len(self.probs) - 1
+
+    def negate(self):
+        """The PMF of -X."""
+        return PMF(-self.max_outcome, self.probs[::-1], self.error)
+
+    def mean(self):
+        return float(np.dot(self.outcomes(), self.probs)) if len(self.probs) else 0.0
+
+    def quantile(self, q):
+        """Smallest outcome x with P(X <= x) >= q, for a scalar or array of q in [0, 1]."""
+        cdf = np.cumsum(self.probs)
+        idx = np.searchsorted(cdf, np.asarray(q) * cdf[-1] - 1e-12)
+        return self.offset + np.minimum(idx, len(self.probs) - 1)
+
+    def prob_at_least(self, thresholds):
+        """P(X >= t) for a scalar or array of thresholds t."""
+        sf = np.append(np.cumsum(self.probs[::-1])[::-1], 0.0)  # sf[i] = P(X >= offset + i)
+        idx = np.clip(np.asarray(thresholds) - self.offset, 0, len(self.probs))
+        return sf[idx]
+
+    # --- dict adapter ---
+    def items(self):
+        nz = np.flatnonzero(self.probs)
+        return list(zip((nz + self.offset).tolist(), self.probs[nz].tolist()))
+
+    def keys(self):
+        return [o for o, _ in self.items()]
+
+    def values(self):
+        return [p for _, p in self.items()]
+
+    def get(self, outcome, default=0):
+        i = outcome - self.offset
+        if 0 <= i < len(self.probs) and self.probs[i] != 0:
+            return float(self.probs[i])
+        return default
+
+    def __getitem__(self, outcome):
+        prob = self.get(outcome, None)
+        if prob is None: raise KeyError(outcome)
+        return prob
+
+    def __contains__(self, outcome):
+        return self.get(outcome, None) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.probs))
+
+    def __repr__(self):
+        error = f", error={self.error!r}" if self.error else ""
+        return f"PMF(offset={self.offset}, probs={self.probs!r}{error})"
+
+
+def _as_pmf(pmf):
+    """Accepts either a PMF or a legacy {outcome: probability} dict."""
+    return pmf if isinstance(pmf, PMF) else PMF.from_dict(pmf)
 
 def get_pmf_for_die(sides, reroll_threshold=0, min_roll=0):
     """Generates the PMF for a single die with proper reroll and minimum roll logic."""
-    if sides <= 0: return {0: 1.0}
+    if sides <= 0: return PMF.point(0)
 
-    base_pmf = {i: 1.0 / sides for i in range(1, sides + 1)}
+    probs = np.full(sides, 1.0 / sides)
 
     if reroll_threshold > 0:
-        prob_of_reroll = sum(p for o, p in base_pmf.items() if o <= reroll_threshold)
-        pmf = {o: p for o, p in base_pmf.items() if o > reroll_threshold}
-        if prob_of_reroll > 0:
-            for o2, p2 in base_pmf.items():
-                pmf[o2] = pmf.get(o2, 0) + prob_of_reroll * p2
-    else:
-        pmf = base_pmf
+        prob_of_reroll = probs[:reroll_threshold].sum()
+        probs[:reroll_threshold] = 0
+        probs += prob_of_reroll / sides
 
-    if min_roll > 0:
-        new_pmf = {}
-        for outcome, prob in pmf.items():
-            final_outcome = max(outcome, min_roll)
-            new_pmf[final_outcome] = new_pmf.get(final_outcome, 0) + prob
-        pmf = new_pmf
+    if min_roll > sides: return PMF.point(min_roll)
+    if min_roll > 1:
+        floored = probs[min_roll - 1:].copy()
+        floored[0] += probs[:min_roll - 1].sum()
+        return PMF(min_roll, floored)
 
-    return pmf
+    return PMF(1, probs)
+
+# Once the operands' lengths multiply to FFT_MIN_WORK (the measured crossover, about two
+# 700-outcome supports), convolution switches from the direct O(n*m) sum to an FFT. The
+# FFT result is checked against the exact total mass and falls back to the direct path if
+# it drifts by more than FFT_TOLERANCE. FFT round-off is absolute, about 3e-16 of the
+# peak, so values below FFT_NOISE times the peak are set to 0, which also clears phantom
+# outcomes in gaps of the support. The first and last FFT_EXACT_TAIL outcomes are
+# recomputed with the direct sum at a constant FFT_EXACT_TAIL**2 cost, so the far tails
+# stay exact however small they are.
+FFT_MIN_WORK = 2**19
+FFT_TOLERANCE = 1e-9
+FFT_NOISE = 1e-14
+FFT_EXACT_TAIL = 64
+
+def _convolve_arrays(a, b):
+    """Convolves two probability arrays, using an FFT for large supports.
+
+    With the FFT, outcomes more than FFT_EXACT_TAIL from either end are accurate to about
+    1e-16 of the largest probability, and those below FFT_NOISE of it are 0.
+    """
+    if len(a) * len(b) < FFT_MIN_WORK: return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+    if abs(result.sum() - a.sum() * b.sum()) > FFT_TOLERANCE: return np.convolve(a, b)
+    result[result < FFT_NOISE * result.max()] = 0.0
+    # Tail outcome k only depends on the first (or last) k + 1 entries of a and b
+    tail = min(FFT_EXACT_TAIL, len(a), len(b))
+    result[:tail] = np.convolve(a[:tail], b[:tail])[:tail]
+    result[n - tail:] = np.convolve(a[-tail:], b[-tail:])[-tail:]
+    return result
 
-def convolve_pmfs(pmf1, pmf2, operation='add'):
-    """Convolves two PMFs."""
-    new_pmf = {}
+def prune_pmf(pmf, epsilon):
+    """Folds each tail holding at most epsilon / 2 of the mass into the nearest kept outcome.
+
+    The folded mass is added to the PMF's error, which bounds the total variation distance
+    to the unpruned result. epsilon <= 0 returns the PMF unchanged.
+    """
+    pmf = _as_pmf(pmf)
+    if epsilon <= 0 or len(pmf.probs) < 2: return pmf
+    head = np.cumsum(pmf.probs)
+    tail = np.cumsum(pmf.probs[::-1])
+    low = int(np.searchsorted(head, epsilon / 2, side='right'))
+    high = len(pmf.probs) - int(np.searchsorted(tail, epsilon / 2, side='right'))
+    if (low == 0 and high == len(pmf.probs)) or low >= high: return pmf
+    probs = pmf.probs[low:high].copy()
+    folded_low = head[low - 1] if low else 0.0
+    folded_high = tail[len(pmf.probs) - high - 1] if high < len(pmf.probs) else 0.0
+    probs[0] += folded_low
+    probs[-1] += folded_high
+    return PMF(pmf.offset + low, probs, pmf.error + folded_low + folded_high)
+
+@iu.instrumented
+def convolve_pmfs(pmf1, pmf2, operation='add', epsilon=0.0):
+    """Convolves two PMFs, pruning tails below epsilon from the result (see prune_pmf)."""
     if not pmf1: return pmf2
     if not pmf2: return pmf1
-    for o1, p1 in pmf1.items():
-        for o2, p2 in pmf2.items():
-            new_outcome = o1 + o2 if operation == 'add' else o1 - o2
-            new_pmf[new_outcome] = new_pmf.get(new_outcome, 0) + p1 * p2
-    return new_pmf
-
-def autoconvolve_pmf(pmf, times, operation='add'):
-    """Convolves a PMF with itself a number of times."""
-    if times <= 0: return {0: 1.0}
+    pmf1, pmf2 = _as_pmf(pmf1), _as_pmf(pmf2)
+    if operation != 'add': pmf2 = pmf2.negate()
+    convolved = PMF(pmf1.offset + pmf2.offset, _convolve_arrays(pmf1.probs, pmf2.probs), pmf1.error + pmf2.error)
+    return prune_pmf(convolved, epsilon)
+
+@iu.instrumented
+def autoconvolve_pmf(pmf, times, operation='add', epsilon=0.0):
+    """Convolves a PMF with itself a number of times, by repeated squaring; epsilon as in convolve_pmfs."""
+    if times <= 0: return PMF.point(0)
+    pmf = _as_pmf(pmf)
     if times == 1: return pmf
-    result = pmf
-    for _ in range(times - 1):
-        result = convolve_pmfs(result, pmf, operation)
-    return result
+    if operation != 'add':
+        return convolve_pmfs(pmf, autoconvolve_pmf(pmf, times - 1, epsilon=epsilon), operation, epsilon)
+    result, square = None, pmf
+    while True:
+        if times & 1:
+            result = square if result is None else convolve_pmfs(result, square, epsilon=epsilon)
+        times >>= 1
+        if not times: return result
+        square = convolve_pmfs(square, square, epsilon=epsilon)
+
+def stack_pmfs(pmfs):
+    """Aligns PMFs on a common support; returns (offset, 2D array with one row per PMF)."""
+    pmfs = [_as_pmf(p) for p in pmfs]
+    supported = [p for p in pmfs if len(p.probs)] or [PMF.point(0, 0.0)]
+    lo = min(p.offset for p in supported)
+    hi = max(p.max_outcome for p in supported)
+    stacked = np.zeros((len(pmfs), hi - lo + 1))
+    for row, pmf in zip(stacked, pmfs):
+        row[pmf.offset - lo:pmf.max_outcome - lo + 1] = pmf.probs
+    return lo, stacked
+
+def mix_pmfs(weighted_pmfs):
+    """Returns the mixture sum(weight * pmf) of (weight, pmf) pairs as one PMF."""
+    weighted_pmfs = [(w, p) for w, p in weighted_pmfs if w > 0 and len(p)]
+    if not weighted_pmfs: return PMF(0, [])
+    weights, pmfs = zip(*weighted_pmfs)
+    offset, stacked = stack_pmfs(pmfs)
+    return PMF(offset, np.asarray(weights) @ stacked, sum(w * p.error for w, p in weighted_pmfs))
+
+@iu.instrumented
+def keep_dice_pmf(die_pmf, count, keep, lowest=False):
+    """PMF of the sum of the highest (or lowest) keep of count dice, e.g. 4d6kh3."""
+    die_pmf = _as_pmf(die_pmf)
+    totals = _keep_dice_table(die_pmf.outcomes(), die_pmf.probs, count, keep, lowest, np.float64)
+    first = int(np.flatnonzero(totals)[0])
+    return PMF(first, totals[first:])
+
+def _keep_dice_table(faces, weights, count, keep, lowest, dtype):
+    """Weights of every kept total 0..keep * max face, from per-face probabilities or counts.
+
+    Dynamic programming over order statistics: faces are visited from best to worst,
+    choosing how many of the remaining dice land on each one (a binomial split), and the
+    first keep dice placed are the kept ones. Cost is O(S * N^2 * keep * S), not S^N.
+    """
+    if not lowest: faces, weights = faces[::-1], weights[::-1]
+    max_total = keep * max(int(faces.max()), 0)
+    # dp[n, s]: weight of the n dice placed so far showing the best faces seen, keeping a total of s
+    dp = np.zeros((count + 1, max_total + 1), dtype=dtype)
+    dp[0, 0] = 1
+    for face, w in zip(faces.tolist(), weights.tolist()):
+        if w == 0: continue
+        new_dp = np.zeros_like(dp)
+        for placed in range(count + 1):
+            row = dp[placed]
+            if not row.any(): continue
+            for c in range(count - placed + 1):
+                weight = math.comb(count - placed, c) * w ** c
+                shift = face * min(c, max(keep - placed, 0))
+                if shift: new_dp[placed + c, shift:] += weight * row[:-shift]
+                else: new_dp[placed + c] += weight * row
+        dp = new_dp
+    return dp[count]
 
 def apply_advantage_or_disadvantage(pmf, mode='advantage'):
     """Applies (dis)advantage or Elven Accuracy to a PMF."""
+    pmf = _as_pmf(pmf)
     if mode == 'straight' or len(pmf) <= 1: return pmf
-    sorted_outcomes = sorted(pmf.items())
-    outcomes = [item[0] for item in sorted_outcomes]
-    probs = np.array([item[1] for item in sorted_outcomes])
-    cdf = np.cumsum(probs)
+    cdf = np.cumsum(pmf.probs)
     if mode == 'advantage': new_cdf = cdf ** 2
     elif mode == 'disadvantage': new_cdf = 1 - (1 - cdf) ** 2
     elif mode == 'elven accuracy': new_cdf = cdf ** 3
     else: return pmf
-    new_probs = np.diff(np.insert(new_cdf, 0, 0))
-    return {outcomes[i]: new_probs[i] for i in range(len(outcomes))}
+    # Each extra roll can carry the pruning error once more
+    rolls = 3 if mode == 'elven accuracy' else 2
+    return PMF(pmf.offset, np.diff(new_cdf, prepend=0), rolls * pmf.error)
+
+# --- Exact Counts ---
+
+# Largest value int64 count arrays may hold; anything that could exceed it uses Python ints
+_INT64_LIMIT = 2**63 - 1
+
+def _count_dtype(bound):
+    return np.int64 if bound <= _INT64_LIMIT else object
+
+class CountPMF:
+    """An exact PMF: integer outcome counts over a common denominator, e.g. the 6**n ways of nd6.
+
+    counts[i] / denominator is the probability of outcome offset + i. Counts are int64
+    while every value provably fits and Python ints (object arrays) beyond that, so no
+    rounding ever happens until to_pmf(). Equal distributions compare and hash equal.
+    """
+    __slots__ = ('offset', 'counts', 'denominator')
+
+    def __init__(self, offset, counts, denominator):
+        self.offset = int(offset)
+        self.denominator = int(denominator)
+        self.counts = np.asarray(counts, dtype=_count_dtype(self.denominator))
+
+    @classmethod
+    def point(cls, value):
+        return cls(value, [1], 1)
+
+    def outcomes(self):
+        return np.arange(self.offset, self.offset + len(self.counts))
+
+    def negate(self):
+        """The counts of -X."""
+        return CountPMF(-(self.offset + len(self.counts) - 1), self.counts[::-1], self.denominator)
+
+    def probability(self, outcome):
+        """The exact probability of outcome as a Fraction."""
+        i = outcome - self.offset
+        count = int(self.counts[i]) if 0 <= i < len(self.counts) else 0
+        return Fraction(count, self.denominator)
+
+    def to_pmf(self):
+        """The float PMF, each probability rounded once from its exact value."""
+        if self.denominator < 2**53 and self.counts.dtype != object:
+            return PMF(self.offset, self.counts / self.denominator)  # both sides are exact doubles
+        return PMF(self.offset, [count / self.denominator for count in self.counts.tolist()])
+
+    def _canonical(self):
+        counts = [int(c) for c in self.counts.tolist()]
+        divisor = math.gcd(self.denominator, *counts)
+        return self.offset, self.denominator // divisor, tuple(c // divisor for c in counts)
+
+    def __eq__(self, other):
+        return isinstance(other, CountPMF) and self._canonical() == other._canonical()
+
+    def __hash__(self):
+        return hash(self._canonical())
+
+    def __repr__(self):
+        return f"CountPMF(offset={self.offset}, counts={self.counts!r}, denominator={self.denominator})"
+
+def get_counts_for_die(sides, reroll_threshold=0, min_roll=0):
+    """Exact counts for a single die, with the same reroll and minimum roll rules as get_pmf_for_die."""
+    if sides <= 0: return CountPMF.point(0)
+    counts, denominator = np.ones(sides, dtype=np.int64), sides
+
+    if reroll_threshold > 0:
+        # Over sides**2 equally likely (first roll, reroll) pairs
+        counts = np.full(sides, min(reroll_threshold, sides), dtype=np.int64)
+        counts[reroll_threshold:] += sides
+        denominator = sides * sides
+
+    if min_roll > sides: return CountPMF.point(min_roll)
+    if min_roll > 1:
+        floored = counts[min_roll - 1:].copy()
+        floored[0] += counts[:min_roll - 1].sum()
+        return CountPMF(min_roll, floored, denominator)
+
+    return CountPMF(1, counts, denominator)
+
+def convolve_counts(counts1, counts2, operation='add'):
+    """Exact convolution of two CountPMFs; the denominators multiply."""
+    if operation != 'add': counts2 = counts2.negate()
+    denominator = counts1.denominator * counts2.denominator
+    dtype = _count_dtype(denominator)
+    convolved = np.convolve(counts1.counts.astype(dtype), counts2.counts.astype(dtype))
+    return CountPMF(counts1.offset + counts2.offset, convolved, denominator)
+
+def autoconvolve_counts(counts, times):
+    """Exact sum of times independent copies of a CountPMF, by repeated squaring."""
+    if times <= 0: return CountPMF.point(0)
+    result, square = None, counts
+    while True:
+        if times & 1:
+            result = square if result is None else convolve_counts(result, square)
+        times >>= 1
+        if not times: return result
+        square = convolve_counts(square, square)
+
+def keep_dice_counts(die_counts, count, keep, lowest=False):
+    """Exact counterpart of keep_dice_pmf, over a denominator of die_counts.denominator ** count."""
+    denominator = die_counts.denominator ** count
+    totals = _keep_dice_table(die_counts.outcomes(), die_counts.counts, count, keep, lowest,
+                              _count_dtype(denominator))
+    first = int(np.flatnonzero(totals)[0])
+    return CountPMF(first, totals[first:], denominator)
+
+def apply_advantage_or_disadvantage_counts(counts, mode='advantage'):
+    """Exact counterpart of apply_advantage_or_disadvantage."""
+    rolls = {'advantage': 2, 'disadvantage': 2, 'elven accuracy': 3}.get(mode)
+    if rolls is None or len(counts.counts) <= 1: return counts
+    denominator = counts.denominator ** rolls
+    cdf = np.cumsum(counts.counts.astype(_count_dtype(denominator)))
+    if mode == 'disadvantage':
+        new_cdf = denominator - (counts.denominator - cdf) ** 2
+    else:
+        new_cdf = cdf ** rolls
+    return CountPMF(counts.offset, np.diff(new_cdf, prepend=0), denominator)
 
 # --- Advanced Dice String Parser ---
 
-def parse_and_calculate_pmf(expression):
-    """Parses a dice expression and returns its PMF."""
+# A compiled expression is a normalized, hashable AST: the signed dice terms in their
+# original order, with every constant term folded into a single integer.
+# keep is the number of dice kept (None keeps them all), the lowest ones if keep_lowest.
+DiceTerm = namedtuple('DiceTerm', ['count', 'sides', 'reroll', 'min_roll', 'mode', 'keep', 'keep_lowest'],
+                      defaults=(None, False))
+DiceExpression = namedtuple('DiceExpression', ['dice', 'constant'])
+
+EXPRESSION_CACHE_SIZE = 1024
+PMF_CACHE_SIZE = 512
+
+_MODES = {'adv': 'advantage', 'disadv': 'disadvantage', 'ea': 'elven accuracy'}
+_MODE_PREFIXES = {mode: prefix for prefix, mode in _MODES.items()}
+_WRAPPED_REGEX = re.compile(r'(adv|disadv|ea)\((.*)\)$')
+_DICE_REGEX = re.compile(r'(\d+)d(\d+)(?:r(\d+))?(?:m(\d+))?(?:k([hl])(\d+))?$')
+_CONSTANT_REGEX = re.compile(r'-?\d+$')
+
+@iu.instrumented
+def parse_and_calculate_pmf(expression, exact=False, epsilon=0.0):
+    """Parses a dice expression and returns its PMF.
+
+    With exact=True the PMF is built from exact integer counts and rounded to floats only
+    once at the end, so it is bit-for-bit reproducible however the dice are combined.
+    With epsilon > 0, tails below epsilon are pruned after every convolution and the
+    discarded mass is reported in the PMF's error.
+    """
+    if exact: return _frozen(parse_and_calculate_counts(expression).to_pmf())
+    return _expression_pmf(compile_expression(expression), epsilon)
+
+def parse_and_calculate_counts(expression):
+    """Parses a dice expression and returns its exact CountPMF."""
+    return _expression_counts(compile_expression(expression))
+
+def compile_expression(expression):
+    """Compiles a dice string into a DiceExpression, memoized on its normalized text."""
     try:
-        if 'adv(' in str(expression) or 'disadv(' in str(expression) or 'ea(' in str(expression):
-            if not re.search(r'(adv|disadv|ea)\(\d+d\d+(r\d+)?(m\d+)?\)', str(expression).replace(" ","")):
-                 raise ValueError("Advantage/Disadvantage must apply directly to a dice term (e.g., 'adv(1d20)+5' not 'adv(1d20+5)'.")
-
-        tokens = _tokenize(expression)
-        if not tokens: return {0: 1.0}
-        if tokens[0] in ['+', '-']: tokens.insert(0, '0')
-
-        current_pmf = _calculate_term_pmf(tokens[0])
-        i = 1
-        while i < len(tokens):
-            operator, term = tokens[i], tokens[i+1]
-            term_pmf = _calculate_term_pmf(term)
-            op_func = 'add' if operator == '+' else 'subtract'
-            current_pmf = convolve_pmfs(current_pmf, term_pmf, op_func)
-            i += 2
-        return current_pmf
+        return _compile_normalized(str(expression).lower().replace(" ", ""))
     except (ValueError, IndexError, TypeError) as e:
         raise ValueError(f"Invalid dice string: '{expression}'. {e}")
 
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+@iu.instrumented
+def _compile_normalized(expression):
+    if 'adv(' in expression or 'ea(' in expression:
+        if not re.search(r'(adv|disadv|ea)\(\d+d\d+(r\d+)?(m\d+)?(k[hl]\d+)?\)', expression):
+             raise ValueError("Advantage/Disadvantage must apply directly to a dice term (e.g., 'adv(1d20)+5' not 'adv(1d20+5)'.")
+
+    tokens = _tokenize(expression)
+    if tokens and tokens[0] not in ['+', '-']: tokens.insert(0, '+')
+    if len(tokens) % 2: raise ValueError("Expression ends with a dangling operator or term.")
+
+    dice, constant = [], 0
+    for operator, token in zip(tokens[::2], tokens[1::2]):
+        if operator not in ['+', '-']: raise ValueError(f"Expected '+' or '-' before '{token}'.")
+        sign = 1 if operator == '+' else -1
+        term = _parse_term(token)
+        if isinstance(term, DiceTerm): dice.append((sign, term))
+        else: constant += sign * term
+    return DiceExpression(tuple(dice), constant)
+
+def cache_info():
+    """Hit/miss counters for the compiled-expression and PMF caches."""
+    return {
+        'expressions': _compile_normalized.cache_info(),
+        'term_pmfs': _cached_term_pmf.cache_info(),
+        'expression_pmfs': _cached_expression_pmf.cache_info(),
+        'term_counts': _term_counts.cache_info(),
+        'expression_counts': _expression_counts.cache_info(),
+        'transform_maps': _transform_map.cache_info(),
+    }
+
+def clear_caches():
+    _compile_normalized.cache_clear()
+    _cached_term_pmf.cache_clear()
+    _cached_expression_pmf.cache_clear()
+    _term_counts.cache_clear()
+    _expression_counts.cache_clear()
+    _transform_map.cache_clear()
+
+class PMFCache:
+    """A thread-safe least-recently-used cache of PMFs, bounded by the total size of their arrays."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached PMF for key, calling compute() to fill it on a miss."""
+        with self._lock:
+            pmf = self._entries.get(key)
+            if pmf is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return pmf
+            self.misses += 1
+        pmf = _frozen(compute())
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = pmf
+                self._bytes += pmf.probs.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.probs.nbytes
+        return pmf
+
+    def get(self, key):
+        """The cached PMF for key, or None; does not count as a hit or miss."""
+        with self._lock:
+            pmf = self._entries.get(key)
+            if pmf is not None: self._entries.move_to_end(key)
+            return pmf
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = 0
+
 def _tokenize(expression):
     """Splits a dice string into its component parts."""
     expression = str(expression).lower().replace(" ", "")
     if not expression: return []
-    token_regex = r'(adv|disadv|ea)\((\d+d\d+(?:r\d+)?(?:m\d+)?)\)|(\d+d\d+(?:r\d+)?(?:m\d+)?)|([+-])|(-?\d+)'
+    token_regex = r'(adv|disadv|ea)\((\d+d\d+(?:r\d+)?(?:m\d+)?(?:k[hl]\d+)?)\)|(\d+d\d+(?:r\d+)?(?:m\d+)?(?:k[hl]\d+)?)|([+-])|(-?\d+)'
     matches = re.findall(token_regex, expression)
     tokens = []
     for match in matches:
@@ -98,116 +523,273 @@ def _tokenize(expression):
         elif match[4]: tokens.append(match[4])
     return tokens
 
-def _calculate_term_pmf(term):
-    """Calculates the PMF for a single tokenized term."""
-    adv_match = re.match(r'(adv|disadv|ea)\((\d+d\d+.*?)\)', term)
-    if adv_match:
-        mode_str, inner_term = adv_match.groups()
-        mode = {'adv': 'advantage', 'disadv': 'disadvantage', 'ea': 'elven accuracy'}[mode_str]
-        base_pmf = _calculate_dice_pmf(inner_term)
-        return apply_advantage_or_disadvantage(base_pmf, mode)
-    if 'd' in term: return _calculate_dice_pmf(term)
-    if term.isdigit() or (term.startswith('-') and term[1:].isdigit()): return {int(term): 1.0}
+def _parse_term(term):
+    """Parses a single token into a normalized DiceTerm, or an int for a constant."""
+    mode = 'straight'
+    wrapped = _WRAPPED_REGEX.match(term)
+    if wrapped: mode, term = _MODES[wrapped.group(1)], wrapped.group(2)
+    dice = _DICE_REGEX.match(term)
+    if dice:
+        n, s, reroll, min_roll = (int(g) if g else 0 for g in dice.groups()[:4])
+        keep_side, keep = dice.group(5), int(dice.group(6)) if dice.group(6) else None
+        if keep is not None and keep >= n: keep = None  # Keeping every die is a plain sum
+        return DiceTerm(n, s, reroll, min_roll if min_roll > 1 else 0, mode,
+                        keep, keep is not None and keep_side == 'l')
+    if 'd' in term: raise ValueError(f"Invalid dice format: {term}")
+    if mode == 'straight' and _CONSTANT_REGEX.match(term): return int(term)
     raise ValueError(f"Unknown term format: '{term}'")
 
-def _calculate_dice_pmf(term):
-    """Calculates PMF for a dice term like '2d6r1m2'."""
-    sign = -1 if term.startswith('-') else 1
-    term = term.lstrip('-')
-    d_match = re.match(r'(\d+)d(\d+)', term)
-    if not d_match: raise ValueError(f"Invalid dice format: {term}")
-    n, s = map(int, d_match.groups())
-    reroll_match = re.search(r'r(\d+)', term)
-    reroll_threshold = int(reroll_match.group(1)) if reroll_match else 0
-    min_roll_match = re.search(r'm(\d+)', term)
-    min_roll = int(min_roll_match.group(1)) if min_roll_match else 0
-    single_die_pmf = get_pmf_for_die(s, reroll_threshold, min_roll)
-    pmf = autoconvolve_pmf(single_die_pmf, n)
-    return {k * sign: v for k, v in pmf.items()}
-
-def _get_dice_and_constants(expression):
-    """Separates a dice expression into dice terms (with signs) and a single constant."""
-    tokens = _tokenize(str(expression))
-    if not tokens: return [], 0
-    if tokens[0] not in ['+', '-']: tokens.insert(0, '+')
-
-    dice_parts = []
-    constant = 0
-    i = 0
-    while i < len(tokens):
-        op, term = tokens[i], tokens[i+1]
-        if 'd' in term:
-            dice_parts.append((op, term))
-        else:
-            constant += int(term) if op == '+' else -int(term)
-        i += 2
-    return dice_parts, constant
+def _format_term(term):
+    """Renders a DiceTerm back into dice-string syntax."""
+    text = f"{term.count}d{term.sides}"
+    if term.reroll: text += f"r{term.reroll}"
+    if term.min_roll: text += f"m{term.min_roll}"
+    if term.keep is not None: text += f"k{'l' if term.keep_lowest else 'h'}{term.keep}"
+    return text if term.mode == 'straight' else f"{_MODE_PREFIXES[term.mode]}({text})"
+
+def _frozen(pmf):
+    """Marks a PMF that is about to be shared through a cache as read-only."""
+    pmf.probs.flags.writeable = False
+    return pmf
+
+# Callers go through _term_pmf / _expression_pmf, which always pass epsilon positionally as a
+# float: lru_cache keys f(x), f(x, 0.0) and f(x, 0) apart, so equal PMFs would be cached twice.
+def _term_pmf(term, epsilon=0.0):
+    """Calculates the PMF for a single DiceTerm; equivalent terms share one cache entry."""
+    return _cached_term_pmf(term, float(epsilon))
+
+def _expression_pmf(compiled, epsilon=0.0):
+    """Calculates the PMF for a compiled DiceExpression."""
+    return _cached_expression_pmf(compiled, float(epsilon))
+
+@lru_cache(maxsize=PMF_CACHE_SIZE)
+def _cached_term_pmf(term, epsilon):
+    single_die_pmf = get_pmf_for_die(term.sides, term.reroll, term.min_roll)
+    if term.keep is not None:
+        pmf = keep_dice_pmf(single_die_pmf, term.count, term.keep, term.keep_lowest)
+    else:
+        pmf = autoconvolve_pmf(single_die_pmf, term.count, epsilon=epsilon)
+    return _frozen(apply_advantage_or_disadvantage(pmf, term.mode))
+
+@lru_cache(maxsize=PMF_CACHE_SIZE)
+@iu.instrumented
+def _cached_expression_pmf(compiled, epsilon):
+    pmf = PMF.point(compiled.constant)
+    for sign, term in compiled.dice:
+        pmf = convolve_pmfs(pmf, _term_pmf(term, epsilon), 'add' if sign > 0 else 'subtract', epsilon)
+    return _frozen(pmf)
+
+@lru_cache(maxsize=PMF_CACHE_SIZE)
+def _term_counts(term):
+    """Exact counterpart of _term_pmf."""
+    die_counts = get_counts_for_die(term.sides, term.reroll, term.min_roll)
+    if term.keep is not None:
+        counts = keep_dice_counts(die_counts, term.count, term.keep, term.keep_lowest)
+    else:
+        counts = autoconvolve_counts(die_counts, term.count)
+    return _frozen_counts(apply_advantage_or_disadvantage_counts(counts, term.mode))
+
+@lru_cache(maxsize=PMF_CACHE_SIZE)
+def _expression_counts(compiled):
+    """Exact counterpart of _expression_pmf."""
+    counts = CountPMF.point(compiled.constant)
+    for sign, term in compiled.dice:
+        counts = convolve_counts(counts, _term_counts(term), 'add' if sign > 0 else 'subtract')
+    return _frozen_counts(counts)
+
+def _frozen_counts(counts):
+    counts.counts.flags.writeable = False
+    return counts
+
+def _double_dice(compiled):
+    """Doubles the dice count of every positive dice term in a compiled expression."""
+    dice = []
+    for sign, term in compiled.dice:
+        if sign < 0: dice.append((sign, term))
+        # 8d6kh3 is not two rolls of 4d6kh3, so keep-terms are rolled twice instead
+        elif term.keep is not None: dice.extend([(sign, term), (sign, term)])
+        else: dice.append((sign, term._replace(count=term.count * 2)))
+    return compiled._replace(dice=tuple(dice))
 
 def double_dice_in_expression(expression):
     """Takes a dice expression, doubles only the positive dice, and returns the new PMF."""
-    dice_parts, constant = _get_dice_and_constants(expression)
-    
-    all_pmfs = []
-    for op, term in dice_parts:
-        if op == '+':
-            doubled_term = re.sub(r'(\d+)', lambda m: str(int(m.group(1)) * 2), term, 1)
-            all_pmfs.append(_calculate_term_pmf(doubled_term))
-        else: # op == '-'
-            all_pmfs.append(_calculate_term_pmf(f"-{term}"))
-
-    final_dice_pmf = {}
-    if all_pmfs:
-        final_dice_pmf = all_pmfs[0]
-        for next_pmf in all_pmfs[1:]:
-            final_dice_pmf = convolve_pmfs(final_dice_pmf, next_pmf)
-
-    return convolve_pmfs(final_dice_pmf, {constant: 1.0})
+    return _expression_pmf(_double_dice(compile_expression(expression)))
 
 def get_doubled_dice_string(expression):
     """Takes a dice expression, doubles only the positive dice, and returns the new string."""
-    dice_parts, constant = _get_dice_and_constants(expression)
-    
-    new_parts = []
-    for op, term in dice_parts:
-        if op == '+':
-            # Double the number of dice
-            doubled_term = re.sub(r'(\d+)', lambda m: str(int(m.group(1)) * 2), term, 1)
-            new_parts.append(f"+{doubled_term}")
-        else: # op == '-'
-            new_parts.append(f"-{term}")
-
-    if constant != 0:
-        new_parts.append(f"{constant:+}")
-        
+    doubled = _double_dice(compile_expression(expression))
+
+    new_parts = [('+' if sign > 0 else '-') + _format_term(term) for sign, term in doubled.dice]
+    if doubled.constant != 0:
+        new_parts.append(f"{doubled.constant:+}")
+
     # Join and clean up
     result = "".join(new_parts).lstrip('+')
     if not result:
-        return str(constant)
+        return str(doubled.constant)
     return result
 
+# --- Damage Transforms ---
+
+# A transform is a list of steps applied to each damage outcome in order: 'halve' (rounding
+# down), 'double', 'floor' (clamp at zero), ('subtract', n) and ('cap', n). Every step is an
+# integer map of the outcome axis, so a whole list fuses into a single remap of a PMF.
+_STEPS = {
+    'halve': lambda values, _: values // 2,
+    'double': lambda values, _: values * 2,
+    'floor': lambda values, _: np.maximum(values, 0),
+    'subtract': lambda values, n: values - n,
+    'cap': lambda values, n: np.minimum(values, n),
+}
+
+# The transform behind each of the app's Resistance/Vulnerability options
+RESISTANCE_STEPS = {"Neither": (), "Resistant": ('halve',), "Vulnerable": ('double',)}
+
+def resistance_steps(resistance_type):
+    """Transform steps for a resistance option, matched case-insensitively; unknown options change nothing."""
+    for name, steps in RESISTANCE_STEPS.items():
+        if name.lower() == resistance_type.lower(): return list(steps)
+    return []
+
+def _normalize_steps(steps):
+    """Steps as a hashable tuple of (name, argument) pairs."""
+    normalized = []
+    for step in steps:
+        name, arg = (step, 0) if isinstance(step, str) else (step[0], int(step[1]))
+        if name not in _STEPS: raise ValueError(f"Unknown damage transform step: {step!r}")
+        normalized.append((name, arg))
+    return tuple(normalized)
+
+def transform_values(values, steps):
+    """Applies transform steps to an integer array of damage values."""
+    for name, arg in _normalize_steps(steps):
+        values = _STEPS[name](values, arg)
+    return values
+
+@lru_cache(maxsize=PMF_CACHE_SIZE)
+def _transform_map(steps, offset, length):
+    """(new offset, new index of each old outcome) for normalized steps, or None if nothing moves."""
+    outcomes = np.arange(offset, offset + length)
+    mapped = transform_values(outcomes, steps)
+    if np.array_equal(mapped, outcomes): return None
+    new_offset = int(mapped.min())
+    index = mapped - new_offset
+    index.flags.writeable = False
+    return new_offset, index
+
+def transform_pmf(pmf, steps):
+    """Applies a list of transform steps to a PMF in one remapping pass over its array."""
+    pmf = _as_pmf(pmf)
+    steps = _normalize_steps(steps)
+    if not steps or not len(pmf.probs): return pmf
+    remap = _transform_map(steps, pmf.offset, len(pmf.probs))
+    if remap is None: return pmf
+    new_offset, index = remap
+    return PMF(new_offset, np.bincount(index, weights=pmf.probs), pmf.error)
+
 def floor_pmf_at_zero(pmf):
     """Ensures no outcomes in the PMF are below zero by consolidating them into the 0 outcome."""
-    new_pmf = {}
-    zero_prob = 0
-    for outcome, prob in pmf.items():
-        if outcome < 0:
-            zero_prob += prob
-        else:
-            new_pmf[outcome] = new_pmf.get(outcome, 0) + prob
-    if zero_prob > 0:
-        new_pmf[0] = new_pmf.get(0, 0) + zero_prob
+    pmf = _as_pmf(pmf)
     # Ensure 0 is in the pmf if it's empty otherwise, to avoid issues down the line
-    if not new_pmf:
-        return {0: 1.0}
-    return new_pmf
-
+    if not len(pmf.probs): return PMF.point(0)
+    return transform_pmf(pmf, ['floor'])
 
-# --- Mitigation Functions ---
 def apply_resistance_vulnerability(pmf, resistance_type):
     """Applies resistance or vulnerability to a PMF."""
-    if resistance_type.lower() == "neither": return pmf
-    new_pmf = {}
-    for outcome, prob in pmf.items():
-        new_outcome = int(np.floor(outcome / 2)) if resistance_type.lower() == "resistant" else outcome * 2
-        new_pmf[new_outcome] = new_pmf.get(new_outcome, 0) + prob
-    return new_pmf
+    return transform_pmf(pmf, resistance_steps(resistance_type))
+
+# --- Analytic Moments ---
+
+# Raw moments E[X^k] ('plain') and parity-twisted moments E[X^k (-1)^X] ('twisted'), k = 0..3.
+# Both combine over independent sums by the same binomial rule, and together they give the
+# exact moments of floor(X / 2), so halving damage needs no PMF. twisted is None once it is
+# no longer known (after a halving). support is the (min, max) possible outcome.
+Moments = namedtuple('Moments', ['plain', 'twisted', 'support'])
+
+_POWERS = np.arange(4)
+_SIGNS = (-1.0) ** _POWERS
+_FACTORIALS = np.array([1.0, 1.0, 2.0, 6.0])
+
+def _binomial_product(f, g):
+    """Moments of X + Y from the moments of independent X and Y (Leibniz rule)."""
+    # sum_j C(k, j) f_j g_(k-j) is a plain convolution once each moment is divided by k!
+    return np.convolve(f / _FACTORIALS, g / _FACTORIALS)[:4] * _FACTORIALS
+
+def add_moments(a, b):
+    """Moments of the sum of two independent variables."""
+    twisted = None if a.twisted is None or b.twisted is None else _binomial_product(a.twisted, b.twisted)
+    return Moments(_binomial_product(a.plain, b.plain), twisted,
+                   (a.support[0] + b.support[0], a.support[1] + b.support[1]))
+
+def constant_moments(value):
+    plain = float(value) ** _POWERS
+    return Moments(plain, (-1) ** (value % 2) * plain, (value, value))
+
+def pmf_moments(pmf):
+    """Moments of a PMF, read directly off its array."""
+    pmf = _as_pmf(pmf)
+    outcomes = pmf.outcomes()
+    powers = outcomes.astype(float)[None, :] ** _POWERS[:, None]
+    parity = np.where(outcomes % 2, -1.0, 1.0)
+    nonzero = np.flatnonzero(pmf.probs)
+    support = (int(outcomes[nonzero[0]]), int(outcomes[nonzero[-1]]))
+    return Moments(powers @ pmf.probs, powers @ (parity * pmf.probs), support)
+
+def negate_moments(m):
+    twisted = None if m.twisted is None else _SIGNS * m.twisted
+    return Moments(_SIGNS * m.plain, twisted, (-m.support[1], -m.support[0]))
+
+def double_moments(m):
+    """Moments of 2X."""
+    scale = 2.0 ** _POWERS
+    return Moments(scale * m.plain, scale * m.plain, (2 * m.support[0], 2 * m.support[1]))
+
+def halve_moments(m):
+    """Moments of floor(X / 2), or None if X's parity moments are unknown."""
+    if m.twisted is None: return None
+    # floor(X / 2) = (X - B) / 2 with B = X mod 2 = (1 - (-1)^X) / 2, and B^2 = B
+    b = (m.plain[0] - m.twisted[0]) / 2
+    xb = (m.plain[1] - m.twisted[1]) / 2
+    x2b = (m.plain[2] - m.twisted[2]) / 2
+    plain = np.array([
+        m.plain[0],
+        (m.plain[1] - b) / 2,
+        (m.plain[2] - 2 * xb + b) / 4,
+        (m.plain[3] - 3 * x2b + 3 * xb - b) / 8,
+    ])
+    return Moments(plain, None, (m.support[0] // 2, m.support[1] // 2))
+
+def mix_moments(weighted_moments):
+    """Raw moments of a mixture of (weight, Moments) pairs."""
+    return sum(w * m.plain for w, m in weighted_moments if w > 0)
+
+def summarize_moments(plain):
+    """(mean, variance, skewness) from raw moments E[X^0..3]."""
+    mean = plain[1] / plain[0]
+    variance = max(plain[2] / plain[0] - mean ** 2, 0.0)
+    third = plain[3] / plain[0] - 3 * mean * plain[2] / plain[0] + 2 * mean ** 3
+    skewness = third / variance ** 1.5 if variance > 1e-12 else 0.0
+    return mean, variance, skewness
+
+@lru_cache(maxsize=PMF_CACHE_SIZE)
+def _term_moments(term):
+    """Moments of a DiceTerm: per-die moments raised to the dice count by repeated squaring."""
+    if term.mode != 'straight' or term.keep is not None: return pmf_moments(_term_pmf(term))
+    result, square, count = constant_moments(0), pmf_moments(get_pmf_for_die(term.sides, term.reroll, term.min_roll)), term.count
+    while count:
+        if count & 1: result = add_moments(result, square)
+        count >>= 1
+        if count: square = add_moments(square, square)
+    return result
+
+def compiled_moments(compiled):
+    """Moments of a compiled DiceExpression, without building its PMF."""
+    moments = constant_moments(compiled.constant)
+    for sign, term in compiled.dice:
+        term_moments = _term_moments(term)
+        moments = add_moments(moments, term_moments if sign > 0 else negate_moments(term_moments))
+    return moments
+
+def expression_moments(expression):
+    """Moments of a dice string, without building its PMF."""
+    return compiled_moments(compile_expression(expression))
@@ -1,125 +1,431 @@
 import re
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
 import dice_utils as du
-import math
-
-def get_full_damage_distribution(d20_string, ac, crit_range, on_hit_pmf_expr, on_miss_damage, on_crit_pmf_expr):
-    """Calculates the final damage distribution for an attack roll."""
-    final_pmf = {}
-
-    # --- 1. Parse the Attack Roll ---
-    tokens = du._tokenize(d20_string)
-    d20_part = ""
-    bonus_parts = []
-
-    d20_found = False
-    d20_idx = -1
-    for i, token in enumerate(tokens):
-        if '1d20' in token and not d20_found:
-            d20_part = token
-            d20_found = True
-            d20_idx = i
-            break
-
-    if not d20_found:
-        raise ValueError("Attack roll string must contain a '1d20' term.")
-
-    bonus_tokens = tokens[:d20_idx] + tokens[d20_idx+1:]
-    bonus_expr = "".join(bonus_tokens)
-    
-    d20_pmf = du._calculate_term_pmf(d20_part)
-    bonus_pmf = du.parse_and_calculate_pmf(bonus_expr) if bonus_expr else {0: 1.0}
-
-    # --- 2. Calculate Damage PMFs ---
+import instrument_utils as iu
+
+def is_d20_term(term):
+    """Whether a DiceTerm is a single d20 roll, including 2d20kh1-style (dis)advantage."""
+    return term.sides == 20 and (term.count == 1 or term.keep == 1)
+
+def _split_d20_roll(roll_string, roll_name):
+    """Splits a d20 roll string into the d20 term's PMF and the PMF of everything else."""
+    compiled = du.compile_expression(roll_string)
+    for i, (sign, term) in enumerate(compiled.dice):
+        if sign > 0 and is_d20_term(term):
+            bonus = compiled._replace(dice=compiled.dice[:i] + compiled.dice[i+1:])
+            return du._term_pmf(term), du._expression_pmf(bonus)
+    raise ValueError(f"{roll_name} string must contain a '1d20' term.")
+
+# --- Outcome Probability Engine ---
+
+def get_attack_outcome_probabilities(d20_pmf, bonus_pmf, ac, crit_range):
+    """Returns (P(crit), P(hit), P(miss)) for a d20 attack roll against an AC (or array of ACs)."""
+    faces, face_probs = d20_pmf.outcomes(), d20_pmf.probs
+    is_crit = faces >= crit_range[0]
+    can_hit = ~is_crit & (faces != 1)  # A natural 1 always misses
+
+    p_crit = face_probs[is_crit].sum()
+    needed = np.asarray(ac)[..., None] - faces[can_hit]
+    p_hit = bonus_pmf.prob_at_least(needed) @ face_probs[can_hit]
+    return p_crit, p_hit, np.maximum(face_probs.sum() - p_crit - p_hit, 0.0)
+
+def get_save_success_probability(d20_pmf, bonus_pmf, save_dc):
+    """Returns P(success) for a d20 saving throw against a DC (or array of DCs)."""
+    faces, face_probs = d20_pmf.outcomes(), d20_pmf.probs
+    is_nat_20 = faces == 20  # Nat 20 always succeeds, Nat 1 is not an auto-fail for saves
+
+    p_nat_20 = face_probs[is_nat_20].sum()
+    rest = ~is_nat_20
+    needed = np.asarray(save_dc)[..., None] - faces[rest]
+    return p_nat_20 + bonus_pmf.prob_at_least(needed) @ face_probs[rest]
+
+def _attack_damage_pmfs(on_hit_pmf_expr, on_miss_damage, on_crit_pmf_expr):
+    """Returns the (crit, hit, miss) damage PMFs for an attack."""
     on_hit_pmf = du.parse_and_calculate_pmf(on_hit_pmf_expr)
-    on_miss_pmf = {on_miss_damage: 1.0}
-    
+    on_miss_pmf = du.PMF.point(on_miss_damage)
+
     if on_crit_pmf_expr:
         on_crit_pmf = du.parse_and_calculate_pmf(on_crit_pmf_expr)
     else:
         # Default crit: double dice from base damage string
         on_crit_pmf = du.double_dice_in_expression(on_hit_pmf_expr)
+    return on_crit_pmf, on_hit_pmf, on_miss_pmf
 
-    # --- 3. Combine based on Hit/Crit/Miss ---
-    for d20_roll, d20_prob in d20_pmf.items():
-        if d20_prob == 0: continue
-
-        for bonus, bonus_prob in bonus_pmf.items():
-            if bonus_prob == 0: continue
-
-            final_roll_bonus = d20_roll + bonus
-            prob_path = d20_prob * bonus_prob
-
-            is_crit = d20_roll >= crit_range[0]
-            is_miss = d20_roll == 1
-            is_hit = not is_crit and not is_miss and final_roll_bonus >= ac
-
-            damage_source_pmf = on_crit_pmf if is_crit else (on_hit_pmf if is_hit else on_miss_pmf)
-
-            for damage, damage_prob in damage_source_pmf.items():
-                final_pmf[damage] = final_pmf.get(damage, 0) + prob_path * damage_prob
-
-    return du.floor_pmf_at_zero(final_pmf)
-
-def get_save_damage_distribution(save_dc, save_roll_string, on_fail_pmf_expr, on_succeed_pmf_expr, save_success_behavior, has_evasion):
-    """Calculates damage distribution for a saving throw."""
-    # --- 1. Parse the Save Roll ---
-    tokens = du._tokenize(save_roll_string)
-    d20_part = ""
-    bonus_expr = ""
-    d20_found = False
-    d20_idx = -1
-
-    for i, token in enumerate(tokens):
-        if '1d20' in token and not d20_found:
-            d20_part = token
-            d20_found = True
-            d20_idx = i
-            break
-    
-    if not d20_found:
-        raise ValueError("Saving throw roll string must contain a '1d20' term.")
-
-    bonus_tokens = tokens[:d20_idx] + tokens[d20_idx+1:]
-    bonus_expr = "".join(bonus_tokens)
-
-    d20_pmf = du._calculate_term_pmf(d20_part)
-    save_bonus_pmf = du.parse_and_calculate_pmf(bonus_expr) if bonus_expr else {0: 1.0}
-    
-    # --- 2. Determine the PMF for each outcome (Fail and Succeed) ---
+def _save_damage_pmfs(on_fail_pmf_expr, on_succeed_pmf_expr, save_success_behavior, has_evasion):
+    """Returns the (succeed, fail) damage PMFs for a saving throw."""
     fail_pmf_base = du.parse_and_calculate_pmf(on_fail_pmf_expr)
 
     # Determine the damage on a successful save
     if save_success_behavior == "Custom":
         succeed_pmf_base = du.parse_and_calculate_pmf(on_succeed_pmf_expr)
     elif save_success_behavior == "Half Damage":
-        succeed_pmf_base = {}
-        for k, v in fail_pmf_base.items():
-            new_k = math.floor(k/2)
-            succeed_pmf_base[new_k] = succeed_pmf_base.get(new_k, 0) + v
+        succeed_pmf_base = du.transform_pmf(fail_pmf_base, ['halve'])
     else: # No Damage
-        succeed_pmf_base = {0: 1.0}
+        succeed_pmf_base = du.PMF.point(0)
 
     # Evasion overrides the normal outcomes
     if has_evasion:
-        succeed_pmf = {0: 1.0} # Always 0 damage on success with Evasion
-        fail_pmf = {math.floor(k/2): v for k, v in fail_pmf_base.items()} # Half damage on failure
+        succeed_pmf = du.PMF.point(0) # Always 0 damage on success with Evasion
+        fail_pmf = du.transform_pmf(fail_pmf_base, ['halve']) # Half damage on failure
     else:
         succeed_pmf = succeed_pmf_base
         fail_pmf = fail_pmf_base
+    return succeed_pmf, fail_pmf
+
+def combine_outcomes(outcome_probs, outcome_pmfs, transforms=()):
+    """Mixes per-outcome damage PMFs by their probabilities, floored at zero and transformed in one pass."""
+    return du.transform_pmf(du.mix_pmfs(zip(outcome_probs, outcome_pmfs)), ['floor', *transforms])
+
+@iu.instrumented
+def get_full_damage_distribution(d20_string, ac, crit_range, on_hit_pmf_expr, on_miss_damage, on_crit_pmf_expr, transforms=()):
+    """Calculates the final damage distribution for an attack roll.
+
+    transforms are extra du.transform_pmf steps (e.g. du.resistance_steps("Resistant")),
+    fused with the flooring at zero into a single pass.
+    """
+    d20_pmf, bonus_pmf = _split_d20_roll(d20_string, "Attack roll")
+    outcome_pmfs = _attack_damage_pmfs(on_hit_pmf_expr, on_miss_damage, on_crit_pmf_expr)
+
+    # Mix the Crit/Hit/Miss PMFs
+    outcome_probs = get_attack_outcome_probabilities(d20_pmf, bonus_pmf, ac, crit_range)
+    return combine_outcomes(outcome_probs, outcome_pmfs, transforms)
+
+@iu.instrumented
+def get_save_damage_distribution(save_dc, save_roll_string, on_fail_pmf_expr, on_succeed_pmf_expr, save_success_behavior, has_evasion, transforms=()):
+    """Calculates damage distribution for a saving throw; transforms as in get_full_damage_distribution."""
+    d20_pmf, save_bonus_pmf = _split_d20_roll(save_roll_string, "Saving throw roll")
+    succeed_pmf, fail_pmf = _save_damage_pmfs(on_fail_pmf_expr, on_succeed_pmf_expr, save_success_behavior, has_evasion)
+
+    # Mix the Success/Failure PMFs
+    p_success = get_save_success_probability(d20_pmf, save_bonus_pmf, save_dc)
+    return combine_outcomes((p_success, 1 - p_success), (succeed_pmf, fail_pmf), transforms)
+
+# --- Threshold Sweeps ---
+
+# One row per AC/DC: the damage PMF over damage values offset, offset+1, ..., plus its mean and variance
+DamageSweep = namedtuple('DamageSweep', ['thresholds', 'offset', 'pmfs', 'means', 'variances'])
+
+def _sweep(thresholds, outcome_probs, outcome_pmfs, resistance_type):
+    """Mixes outcome PMFs with per-threshold outcome probabilities into a DamageSweep."""
+    # Flooring and resistance are remaps of the damage axis, so they commute with mixing
+    steps = ['floor', *du.resistance_steps(resistance_type)]
+    outcome_pmfs = [du.transform_pmf(p, steps) for p in outcome_pmfs]
+    offset, stacked = du.stack_pmfs(outcome_pmfs)
+    weights = np.column_stack([np.broadcast_to(p, thresholds.shape) for p in outcome_probs])
+    pmfs = weights @ stacked
+    damage = np.arange(offset, offset + stacked.shape[1])
+    means = pmfs @ damage
+    variances = np.maximum(pmfs @ damage ** 2 - means ** 2, 0.0)
+    return DamageSweep(thresholds, offset, pmfs, means, variances)
+
+@iu.instrumented
+def sweep_attack_damage(d20_string, acs, crit_range, on_hit_pmf_expr, on_miss_damage, on_crit_pmf_expr, resistance_type="Neither"):
+    """Damage distributions for one attack against every AC in acs, parsing and convolving only once."""
+    acs = np.atleast_1d(np.asarray(acs))
+    d20_pmf, bonus_pmf = _split_d20_roll(d20_string, "Attack roll")
+    outcome_pmfs = _attack_damage_pmfs(on_hit_pmf_expr, on_miss_damage, on_crit_pmf_expr)
+    outcome_probs = get_attack_outcome_probabilities(d20_pmf, bonus_pmf, acs, crit_range)
+    return _sweep(acs, outcome_probs, outcome_pmfs, resistance_type)
+
+@iu.instrumented
+def sweep_save_damage(save_dcs, save_roll_string, on_fail_pmf_expr, on_succeed_pmf_expr, save_success_behavior, has_evasion, resistance_type="Neither"):
+    """Damage distributions for one saving throw against every DC in save_dcs, parsing and convolving only once."""
+    save_dcs = np.atleast_1d(np.asarray(save_dcs))
+    d20_pmf, save_bonus_pmf = _split_d20_roll(save_roll_string, "Saving throw roll")
+    outcome_pmfs = _save_damage_pmfs(on_fail_pmf_expr, on_succeed_pmf_expr, save_success_behavior, has_evasion)
+    p_success = get_save_success_probability(d20_pmf, save_bonus_pmf, save_dcs)
+    return _sweep(save_dcs, (p_success, 1 - p_success), outcome_pmfs, resistance_type)
+
+# --- Area of Effect ---
+
+# total: PMF of the damage summed over every target; per_target: each target's own damage PMF;
+# p_success: each target's chance to save. A target is a dict with 'save_roll_string' and
+# optional 'save_resistance' and 'has_evasion', named as in a Saving Throw action.
+AoEResult = namedtuple('AoEResult', ['total', 'per_target', 'p_success'])
+
+@iu.instrumented
+def get_aoe_damage_distribution(targets, save_dc, on_fail_pmf_expr, save_success_behavior="Half Damage"):
+    """Damage from one area spell against a group of targets that all share one damage roll.
+
+    Conditioned on the damage roll, the targets' saves are independent, so the total is
+    built target by target as a table with one row per possible roll: each target adds a
+    two-point (fail / succeed) shift to every row. Cost is linear in the number of targets
+    times the table size, rather than 2**targets save combinations.
+    """
+    if save_success_behavior == "Custom":
+        raise ValueError("AoE damage supports 'No Damage' and 'Half Damage' on a successful save.")
+    fail_pmf = du.parse_and_calculate_pmf(on_fail_pmf_expr)
+    possible = fail_pmf.probs > 0
+    rolled = np.maximum(fail_pmf.outcomes()[possible], 0)
+    roll_probs = fail_pmf.probs[possible]
+
+    p_success, amounts = [], []
+    for target in targets:
+        d20_pmf, save_bonus_pmf = _split_d20_roll(target['save_roll_string'], "Saving throw roll")
+        p_success.append(float(get_save_success_probability(d20_pmf, save_bonus_pmf, save_dc)))
+        if target.get('has_evasion'):
+            fail, succeed = rolled // 2, np.zeros_like(rolled)
+        elif save_success_behavior == "Half Damage":
+            fail, succeed = rolled, rolled // 2
+        else:  # No Damage
+            fail, succeed = rolled, np.zeros_like(rolled)
+        steps = du.resistance_steps(target.get('save_resistance', "Neither"))
+        amounts.append((du.transform_values(fail, steps), du.transform_values(succeed, steps)))
+
+    # table[r, t]: P(total damage so far = base[r] + t | damage roll r), where base[r] is the
+    # total if every target so far saved. Each target then only shifts a row by its extra
+    # damage on a failure, and only the first live[r] columns of a row can be nonzero, so
+    # the work per target is the rows' live extents rather than the widest possible total.
+    base = sum((succeed for _, succeed in amounts), np.zeros_like(rolled))
+    extra = [fail - succeed for fail, succeed in amounts]
+    table = np.zeros((len(rolled), 1 + sum(int(d.max(initial=0)) for d in extra)))
+    table[:, 0] = 1.0
+    live = np.ones(len(rolled), dtype=int)
+    per_target = []
+    for p, (fail, succeed), d in zip(p_success, amounts, extra):
+        for row, shift, width in zip(table, d.tolist(), live.tolist()):
+            if not shift: continue
+            failed = (1 - p) * row[:width]
+            row[:width] *= p
+            row[shift:shift + width] += failed
+        live += d
+        size = int(fail.max(initial=0)) + 1  # a save never deals more than a failure
+        per_target.append(du.PMF(0, np.bincount(fail, weights=roll_probs * (1 - p), minlength=size)
+                                    + np.bincount(succeed, weights=roll_probs * p, minlength=size)))
+
+    total = np.zeros(int((base + live).max(initial=1)))
+    for row, start, width, weight in zip(table, base.tolist(), live.tolist(), roll_probs.tolist()):
+        total[start:start + width] += weight * row[:width]
+    return AoEResult(du.PMF(0, total), per_target, np.array(p_success))
+
+# --- Once-per-Turn Riders ---
+
+# crit / hit: P(the rider first triggers on each attack of the turn, as a crit / as a normal hit);
+# never: P(no attack triggers it)
+FirstTrigger = namedtuple('FirstTrigger', ['crit', 'hit', 'never'])
+# total: PMF of the turn's damage including the rider; rider: PMF of the rider's damage alone
+RiderTurn = namedtuple('RiderTurn', ['total', 'rider', 'first'])
+
+def first_trigger_probabilities(outcome_probs, trigger="hit"):
+    """Where a once-per-turn rider first triggers, from each attack's (P(crit), P(hit), P(miss)).
+
+    trigger is "hit" for riders on any hit (Sneak Attack) or "crit" for riders held for a
+    crit (smiting on the first crit). Attack i triggers first with P(no earlier attack did)
+    times its own trigger chance, so this is linear in the number of attacks.
+    """
+    if trigger not in ("hit", "crit"): raise ValueError(f"Unknown rider trigger: {trigger!r}")
+    p_crit = np.array([float(probs[0]) for probs in outcome_probs])
+    p_hit = np.array([float(probs[1]) for probs in outcome_probs]) if trigger == "hit" else np.zeros(len(p_crit))
+    untriggered = np.cumprod(np.concatenate([[1.0], 1 - p_crit - p_hit]))
+    return FirstTrigger(untriggered[:-1] * p_crit, untriggered[:-1] * p_hit, float(untriggered[-1]))
+
+def _attack_outcomes(params):
+    """(P(crit), P(hit), P(miss)), the (crit, hit, miss) damage PMFs and the floor/resistance steps of an Attack Roll."""
+    d20_pmf, bonus_pmf = _split_d20_roll(params['attack_roll_string'], "Attack roll")
+    outcome_probs = get_attack_outcome_probabilities(d20_pmf, bonus_pmf, params['enemy_ac'], [params['crit_range'], 20])
+    crit_expr = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
+    outcome_pmfs = _attack_damage_pmfs(params['dmg_string'], params['dmg_on_miss'], crit_expr)
+    return outcome_probs, outcome_pmfs, ['floor', *du.resistance_steps(params['enemy_resistance'])]
+
+def _partial_convolve(pmf1, pmf2, epsilon=0.0):
+    """Convolves two PMFs that may hold less than all of the probability; None is no mass at all."""
+    if pmf1 is None or pmf2 is None or not len(pmf1) or not len(pmf2): return None
+    return du.convolve_pmfs(pmf1, pmf2, epsilon=epsilon)
+
+def _partial_mix(weighted_pmfs):
+    mixed = du.mix_pmfs([(w, p) for w, p in weighted_pmfs if p is not None])
+    return mixed if len(mixed) else None
+
+@iu.instrumented
+def get_turn_damage_distribution(attacks, rider_expr, trigger="hit", epsilon=0.0):
+    """Damage of a turn of attacks plus a rider dealt once, on the first attack that triggers it.
+
+    attacks are Attack Roll params dicts, rolled in order. On a crit the rider's dice are
+    doubled as by du.double_dice_in_expression, and it is added to the triggering attack's
+    damage before that attack's flooring and resistance. The turn is built attack by attack
+    from two partial PMFs, damage so far with the rider unused and with it spent, so the
+    cost is linear in the number of attacks instead of 3**attacks outcome combinations.
+    epsilon prunes tails after every convolution, as in du.convolve_pmfs.
+    """
+    outcomes = [_attack_outcomes(params) for params in attacks]
+    first = first_trigger_probabilities([outcome_probs for outcome_probs, _, _ in outcomes], trigger)
+    rider_hit, rider_crit = du.parse_and_calculate_pmf(rider_expr), du.double_dice_in_expression(rider_expr)
+
+    unused, spent, rider = du.PMF.point(0), None, [(first.never, du.PMF.point(0))]
+    for i, ((p_crit, p_hit, p_miss), (crit, hit, miss), steps) in enumerate(outcomes):
+        crit_rider = du.transform_pmf(du.convolve_pmfs(crit, rider_crit), steps)
+        hit_rider = du.transform_pmf(du.convolve_pmfs(hit, rider_hit), steps)
+        crit, hit, miss = (du.transform_pmf(pmf, steps) for pmf in (crit, hit, miss))
+        if trigger == "hit":
+            fires, quiet = [(p_crit, crit_rider), (p_hit, hit_rider)], [(p_miss, miss)]
+        else:
+            fires, quiet = [(p_crit, crit_rider)], [(p_hit, hit), (p_miss, miss)]
+        every = _partial_mix([(p_crit, crit), (p_hit, hit), (p_miss, miss)])
+        spent = _partial_mix([(1.0, _partial_convolve(spent, every, epsilon)),
+                              (1.0, _partial_convolve(unused, _partial_mix(fires), epsilon))])
+        unused = _partial_convolve(unused, _partial_mix(quiet), epsilon)
+        rider += [(first.crit[i], du.transform_pmf(rider_crit, steps)), (first.hit[i], du.transform_pmf(rider_hit, steps))]
+
+    total = _partial_mix([(1.0, unused), (1.0, spent)])
+    return RiderTurn(total, du.mix_pmfs(rider), first)
+
+# --- Saved Actions ---
+
+# The params each action type actually reads; anything else in the dict doesn't affect its PMF
+_ACTION_FIELDS = {
+    "Dice Roll": ['dice_roll_string'],
+    "Attack Roll": ['attack_roll_string', 'enemy_ac', 'enemy_resistance', 'dmg_string',
+                    'crit_range', 'use_custom_crit', 'custom_crit_string', 'dmg_on_miss'],
+    "Saving Throw": ['save_roll_string', 'save_dc', 'save_resistance', 'has_evasion',
+                     'fail_dmg_string', 'save_success_behavior', 'succ_dmg_string'],
+}
+
+_STRING_FIELDS = {field for fields in _ACTION_FIELDS.values() for field in fields if field.endswith('_string')}
+
+ACTION_CACHE_BYTES = 64 * 2**20
+_action_cache = du.PMFCache(ACTION_CACHE_BYTES)
+# Analytic moments are cached per action key, bounded by memory like the PMF cache. Every
+# app rerun walks the whole library in order, so an LRU smaller than the library would miss
+# on every lookup. MOMENTS_ENTRY_BYTES is the measured retained size of one entry (its
+# content key, the moments tuple and lru_cache's bookkeeping, by tracemalloc over 20k
+# distinct actions), rounded up: about 880 bytes for an attack, 810 for a saving throw and
+# 460 for a dice roll. The default therefore holds ~65k actions in at most 64 MB.
+MOMENTS_CACHE_BYTES = 64 * 2**20
+MOMENTS_ENTRY_BYTES = 1024
+# Bumped whenever a change alters computed distributions, so PMFs saved by an older engine
+# (store_utils.save_library records this) are recomputed instead of reused
+ENGINE_VERSION = 1
+
+def action_key(params):
+    """A hashable content key for an action parameters dict, as built by the app's action library.
+
+    Unused fields are dropped and dice strings are normalized, so any two params dicts
+    that describe the same distribution share a key.
+    """
+    key = [params['action_type']]
+    for field in _ACTION_FIELDS[params['action_type']]:
+        value = params.get(field)
+        if field == 'custom_crit_string' and not params.get('use_custom_crit'): continue
+        if field == 'succ_dmg_string' and params.get('save_success_behavior') != "Custom": continue
+        if field in _STRING_FIELDS and value is not None: value = str(value).lower().replace(" ", "")
+        key.append((field, value))
+    return tuple(key)
+
+def action_cache_info():
+    """Hit/miss counters and memory use of the saved-action PMF cache."""
+    return _action_cache.info()
+
+def clear_caches():
+    _action_cache.clear()
+    _cached_action_moments.cache_clear()
+
+@iu.instrumented
+def get_action_distribution(params, calculate=None, store=None):
+    """Calculates the final damage distribution for a saved action's parameters dict, cached on its content.
+
+    The cache and then store (an object whose get(params) returns a precomputed PMF or None,
+    e.g. a store_utils.PMFStore) are consulted first; only on a miss is the PMF computed, by
+    calculate() if given (e.g. a graph_utils.ActionGraph reusing shared nodes).
+    """
+    return _action_cache.get_or_compute(action_key(params), lambda: _stored_or_calculated(params, calculate, store))
+
+def _stored_or_calculated(params, calculate=None, store=None):
+    pmf = store.get(params) if store is not None else None
+    if pmf is not None: return pmf
+    return calculate() if calculate is not None else _calculate_action_distribution(params)
+
+def _calculate_action_distribution(params):
+    if params['action_type'] == "Dice Roll":
+        return du.parse_and_calculate_pmf(params['dice_roll_string'])
+    elif params['action_type'] == "Attack Roll":
+        crit_expr = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
+        return get_full_damage_distribution(
+            d20_string=params['attack_roll_string'],
+            ac=params['enemy_ac'],
+            crit_range=[params['crit_range'], 20],
+            on_hit_pmf_expr=params['dmg_string'],
+            on_miss_damage=params['dmg_on_miss'],
+            on_crit_pmf_expr=crit_expr,
+            transforms=du.resistance_steps(params['enemy_resistance'])
+        )
+    else:  # Saving Throw
+        succ_expr = params.get('succ_dmg_string') if params.get('save_success_behavior') == "Custom" else ""
+        return get_save_damage_distribution(
+            save_dc=params['save_dc'],
+            save_roll_string=params['save_roll_string'],
+            on_fail_pmf_expr=params['fail_dmg_string'],
+            on_succeed_pmf_expr=succ_expr,
+            save_success_behavior=params['save_success_behavior'],
+            has_evasion=params['has_evasion'],
+            transforms=du.resistance_steps(params['save_resistance'])
+        )
+
+# --- Analytic Moments ---
+
+def _component_moments(moments, build_pmf, steps):
+    """Moments of one outcome's damage after 'halve' / 'double' / 'floor' steps.
+
+    Steps are applied in closed form; only if one can't be (halving twice, or flooring a
+    component that can go negative) is the component's PMF built instead.
+    """
+    closed = moments
+    for step in steps:
+        if step == 'halve': closed = du.halve_moments(closed)
+        elif step == 'double': closed = du.double_moments(closed)
+        elif closed.support[0] < 0: closed = None  # 'floor' is a no-op unless damage can be negative
+        if closed is None: break
+    if closed is not None: return closed
+
+    return du.pmf_moments(du.transform_pmf(build_pmf(), steps))
+
+@iu.instrumented
+def get_action_moments(params):
+    """(mean, variance, skewness) of a saved action's damage, without building its PMF."""
+    return _cached_action_moments(action_key(params))
+
+@lru_cache(maxsize=MOMENTS_CACHE_BYTES // MOMENTS_ENTRY_BYTES)
+def _cached_action_moments(key):
+    params = dict(key[1:], action_type=key[0])
+
+    if params['action_type'] == "Dice Roll":
+        return du.summarize_moments(du.expression_moments(params['dice_roll_string']).plain)
+
+    elif params['action_type'] == "Attack Roll":
+        d20_pmf, bonus_pmf = _split_d20_roll(params['attack_roll_string'], "Attack roll")
+        outcome_probs = get_attack_outcome_probabilities(d20_pmf, bonus_pmf, params['enemy_ac'], [params['crit_range'], 20])
+        steps = ['floor'] + du.resistance_steps(params['enemy_resistance'])
+
+        dmg_string = params['dmg_string']
+        crit_string = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
+        if crit_string:
+            crit = _component_moments(du.expression_moments(crit_string), lambda: du.parse_and_calculate_pmf(crit_string), steps)
+        else:
+            doubled = du._double_dice(du.compile_expression(dmg_string))
+            crit = _component_moments(du.compiled_moments(doubled), lambda: du.double_dice_in_expression(dmg_string), steps)
+        hit = _component_moments(du.expression_moments(dmg_string), lambda: du.parse_and_calculate_pmf(dmg_string), steps)
+        miss = _component_moments(du.constant_moments(params['dmg_on_miss']), lambda: du.PMF.point(params['dmg_on_miss']), steps)
+        return du.summarize_moments(du.mix_moments(zip(outcome_probs, [crit, hit, miss])))
+
+    else:  # Saving Throw
+        d20_pmf, save_bonus_pmf = _split_d20_roll(params['save_roll_string'], "Saving throw roll")
+        p_success = get_save_success_probability(d20_pmf, save_bonus_pmf, params['save_dc'])
+        steps = ['floor'] + du.resistance_steps(params['save_resistance'])
 
-    # --- 3. Combine based on Save Success/Failure ---
-    final_pmf = {}
-    for d20_roll, d20_prob in d20_pmf.items():
-        for bonus, bonus_prob in save_bonus_pmf.items():
-            total_roll = d20_roll + bonus
-            prob_path = d20_prob * bonus_prob
-            
-            # Nat 20 always succeeds, Nat 1 is not an auto-fail for saves
-            succeeds = (d20_roll == 20) or (total_roll >= save_dc)
-            
-            damage_source_pmf = succeed_pmf if succeeds else fail_pmf
-            
-            for damage, damage_prob in damage_source_pmf.items():
-                final_pmf[damage] = final_pmf.get(damage, 0) + prob_path * damage_prob
-                
-    return du.floor_pmf_at_zero(final_pmf)
+        fail_string = params['fail_dmg_string']
+        fail_moments = du.expression_moments(fail_string)
+        build_fail = lambda: du.parse_and_calculate_pmf(fail_string)
+        zero = du.constant_moments(0)
+        if params['has_evasion']:
+            succeed, fail = zero, _component_moments(fail_moments, build_fail, ['halve'] + steps)
+        else:
+            fail = _component_moments(fail_moments, build_fail, steps)
+            if params['save_success_behavior'] == "Custom":
+                succ_string = params['succ_dmg_string']
+                succeed = _component_moments(du.expression_moments(succ_string), lambda: du.parse_and_calculate_pmf(succ_string), steps)
+            elif params['save_success_behavior'] == "Half Damage":
+                succeed = _component_moments(fail_moments, build_fail, ['halve'] + steps)
+            else: # No Damage
+                succeed = zero
+        return du.summarize_moments(du.mix_moments([(p_success, succeed), (1 - p_success, fail)]))
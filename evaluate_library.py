@@ -0,0 +1,147 @@
+"""Evaluates action-library files without Streamlit and streams the results to CSV or Parquet.
+
+Usage:
+    python evaluate_library.py library.json -o summary.csv
+    python evaluate_library.py a.jsonl b.jsonl -o pmfs.parquet --pmf --workers 8
+    python evaluate_library.py library.json --thresholds 10,20,30 -o -      # CSV to stdout
+
+Library files are either a JSON object mapping names to action params (the shape of the
+app's action library, or the app's saved library.json) or JSON Lines with one {"name": ..., **params} per line. Actions are
+evaluated and written in batches of --batch-size. JSON Lines files are also read one line
+at a time, so memory stays bounded however large they are; a .json file is parsed whole,
+so convert very large libraries to .jsonl. Invalid actions are reported on stderr and the
+exit status is 1. Actions of a saved library.json are read from the PMFs saved beside it
+when their params are unchanged.
+"""
+import argparse
+import csv
+import itertools
+import sys
+from functools import lru_cache
+
+import batch_utils as bu
+import dnd_utils as dndu
+import store_utils as su
+
+DEFAULT_BATCH_SIZE = 1000
+
+@lru_cache(maxsize=None)
+def _stored_pmfs(directory):
+    """A saved library's PMFStore, memory-mapped once per process; empty if it cannot be read."""
+    try:
+        return su.load_library(directory)[1]
+    except (OSError, ValueError, KeyError):
+        return su.PMFStore.empty()
+
+def _evaluate(job):
+    """Result rows for one action: a summary row, or one row per outcome with pmf=True."""
+    source, store_dir, name, params, pmf, percentiles, thresholds = job
+    try:
+        distribution = dndu.get_action_distribution(params, store=_stored_pmfs(store_dir) if store_dir else None)
+    except (ValueError, KeyError, TypeError) as e:
+        return f"{source}: {name}: {type(e).__name__}: {e}"
+    base = {'file': source, 'name': name, 'action_type': params['action_type']}
+    if pmf:
+        return [dict(base, damage=damage, probability=prob) for damage, prob in distribution.items()]
+    return [dict(base, **bu.summarize_pmf(distribution, percentiles, thresholds))]
+
+def output_fields(pmf, percentiles, thresholds):
+    if pmf: return ['file', 'name', 'action_type', 'damage', 'probability']
+    return (['file', 'name', 'action_type', 'mean', 'std'] + [f'p{q}' for q in percentiles]
+            + [f'P(>={x})' for x in thresholds])
+
+class CsvWriter:
+    def __init__(self, path, fields):
+        self.file = sys.stdout if path == '-' else open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fields)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        if self.file is not sys.stdout: self.file.close()
+
+class ParquetWriter:
+    """Writes each batch as a row group, so only one batch is ever held in memory."""
+
+    def __init__(self, path, fields):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow).")
+        self.pa, self.pq, self.path, self.fields, self.writer = pa, pq, path, fields, None
+
+    def write(self, rows):
+        if not rows: return
+        table = self.pa.table({field: [row[field] for row in rows] for field in self.fields})
+        if self.writer is None: self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:  # nothing evaluated: still leave a file with the right columns
+            self.pq.write_table(self.pa.table({field: [] for field in self.fields}), self.path)
+        else:
+            self.writer.close()
+
+def iter_jobs(paths, pmf, percentiles, thresholds):
+    for path in paths:
+        store_dir = su.saved_library_dir(path)
+        for name, params in bu.iter_library_file(path):
+            yield (path, store_dir, name, params, pmf, percentiles, thresholds)
+
+def evaluate_files(paths, writer, pmf=False, percentiles=bu.DEFAULT_PERCENTILES, thresholds=(),
+                   workers=1, batch_size=DEFAULT_BATCH_SIZE, chunksize=16):
+    """Evaluates every action in paths batch by batch, passing each batch's rows to writer.
+
+    Returns (number of actions evaluated, list of error messages).
+    """
+    jobs = iter_jobs(paths, pmf, tuple(percentiles), tuple(thresholds))
+    executor = bu.process_pool(workers) if workers > 1 else None
+    evaluated, errors = 0, []
+    try:
+        while True:
+            batch = list(itertools.islice(jobs, batch_size))
+            if not batch: break
+            results = executor.map(_evaluate, batch, chunksize=chunksize) if executor else map(_evaluate, batch)
+            rows = []
+            for result in results:
+                if isinstance(result, str): errors.append(result)
+                else: rows.extend(result)
+            writer.write(rows)
+            evaluated += len(batch)
+    finally:
+        if executor: executor.shutdown()
+    return evaluated, errors
+
+def _int_list(text):
+    return [int(x) for x in text.split(',') if x.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+', help="action-library files (.json or .jsonl)")
+    parser.add_argument('-o', '--output', required=True, help="output .csv or .parquet file, or - for CSV on stdout")
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="default: from the output file's extension")
+    parser.add_argument('--pmf', action='store_true', help="write every action's full PMF instead of summary statistics")
+    parser.add_argument('--percentiles', type=_int_list, default=list(bu.DEFAULT_PERCENTILES))
+    parser.add_argument('--thresholds', type=_int_list, default=[], help="damage values x for P(damage >= x) columns")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    fields = output_fields(args.pmf, args.percentiles, args.thresholds)
+    writer = (ParquetWriter if output_format == 'parquet' else CsvWriter)(args.output, fields)
+    try:
+        evaluated, errors = evaluate_files(args.files, writer, args.pmf, args.percentiles, args.thresholds,
+                                           args.workers, args.batch_size)
+    finally:
+        writer.close()
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(f"Evaluated {evaluated} actions ({len(errors)} failed).", file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import dice_utils as du
+import dnd_utils as dndu
+
+class ActionGraph:
+    """Evaluates named saved actions through shared intermediate nodes, so an edit recomputes only what changed.
+
+    Each node is keyed by exactly the (normalized) inputs it reads: an attack depends on its
+    d20 roll ('roll'), its hit/crit/miss probabilities against the AC ('attack_probs'), its
+    hit and crit damage PMFs and its final mixed PMF ('action'). Editing only the AC rebuilds
+    'attack_probs' and 'action' and reuses every damage PMF; editing only the damage string
+    reuses the d20 + bonus roll. Nodes are shared between actions and dropped as soon as no
+    tracked action uses them.
+
+    A new 'action' node goes through dndu.get_action_distribution, so a PMF already in the
+    content cache or in store (e.g. the session's loaded store_utils.PMFStore) is used as is
+    and its upstream nodes are only built on a miss. An 'action' node keeps the nodes it was
+    built from alive for as long as it is used.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.clear()
+
+    def clear(self):
+        self._nodes = {}         # node key -> value
+        self._deps = {}          # 'action' node key -> node keys it was built from
+        self._users = {}         # node key -> names of the actions that use it
+        self._action_nodes = {}  # action name -> node keys it used when last evaluated
+        self._used = None
+        self.computed = self.reused = 0
+
+    def action_pmf(self, name, params):
+        """The damage PMF of the action called name, tracking its nodes under that name.
+
+        If evaluation fails, nodes it built that no tracked action uses are dropped again.
+        """
+        self._used = []
+        try:
+            pmf = self._evaluate(params)
+        except BaseException:
+            for key in self._used:
+                if key not in self._users:
+                    self._nodes.pop(key, None)
+                    self._deps.pop(key, None)
+            raise
+        finally:
+            used, self._used = self._used, None
+        self._track(name, used)
+        return pmf
+
+    def forget(self, name):
+        """Stops tracking an action, dropping any nodes only it used."""
+        self._track(name, [])
+        del self._action_nodes[name]
+
+    def sync(self, library):
+        """Forgets every tracked action no longer in library (a name -> params dict)."""
+        for name in [n for n in self._action_nodes if n not in library]:
+            self.forget(name)
+
+    def info(self):
+        return {'nodes': len(self._nodes), 'actions': len(self._action_nodes),
+                'computed': self.computed, 'reused': self.reused}
+
+    def _track(self, name, used):
+        old, new = set(self._action_nodes.get(name, ())), set(used)
+        for key in new - old:
+            self._users.setdefault(key, set()).add(name)
+        for key in old - new:
+            users = self._users[key]
+            users.discard(name)
+            if not users:
+                del self._users[key]
+                del self._nodes[key]
+                self._deps.pop(key, None)
+        self._action_nodes[name] = list(new)
+
+    def _node(self, key, compute):
+        self._used.append(key)
+        if key in self._nodes:
+            self.reused += 1
+        else:
+            self.computed += 1
+            self._nodes[key] = compute()
+        return self._nodes[key]
+
+    def _evaluate(self, params):
+        key = dndu.action_key(params)
+        node = ('action', key)
+        if node in self._nodes:
+            self._used.extend(self._deps[node])
+            return self._node(node, None)
+        first_dep = len(self._used)
+        pmf = dndu.get_action_distribution(params, lambda: self._build(params, key), self.store)
+        self._deps[node] = self._used[first_dep:]
+        return self._node(node, lambda: pmf)
+
+    def _build(self, params, key):
+        fields = dict(key[1:])  # dice strings come normalized, so 1d8 + 3 and 1d8+3 share nodes
+
+        if params['action_type'] == "Dice Roll":
+            expression = fields['dice_roll_string']
+            return self._node(('expression', expression), lambda: du.parse_and_calculate_pmf(expression))
+
+        if params['action_type'] == "Attack Roll":
+            roll_string, dmg_string = fields['attack_roll_string'], fields['dmg_string']
+            crit_range = [fields['crit_range'], 20]
+            roll = self._node(('roll', roll_string), lambda: dndu._split_d20_roll(roll_string, "Attack roll"))
+            probs = self._node(('attack_probs', roll_string, fields['enemy_ac'], fields['crit_range']),
+                               lambda: dndu.get_attack_outcome_probabilities(*roll, fields['enemy_ac'], crit_range))
+            hit = self._node(('expression', dmg_string), lambda: du.parse_and_calculate_pmf(dmg_string))
+            crit_string = fields.get('custom_crit_string') if fields['use_custom_crit'] else ""
+            if crit_string:
+                crit = self._node(('expression', crit_string), lambda: du.parse_and_calculate_pmf(crit_string))
+            else:
+                crit = self._node(('doubled', dmg_string), lambda: du.double_dice_in_expression(dmg_string))
+            miss = du.PMF.point(fields['dmg_on_miss'])
+            return dndu.combine_outcomes(probs, (crit, hit, miss), du.resistance_steps(fields['enemy_resistance']))
+
+        roll_string = fields['save_roll_string']
+        roll = self._node(('roll', roll_string), lambda: dndu._split_d20_roll(roll_string, "Saving throw roll"))
+        p_success = self._node(('save_probs', roll_string, fields['save_dc']),
+                               lambda: dndu.get_save_success_probability(*roll, fields['save_dc']))
+        damage_inputs = (fields['fail_dmg_string'], fields.get('succ_dmg_string') or "",
+                         fields['save_success_behavior'], fields['has_evasion'])
+        succeed, fail = self._node(('save_damage',) + damage_inputs, lambda: dndu._save_damage_pmfs(*damage_inputs))
+        return dndu.combine_outcomes((p_success, 1 - p_success), (succeed, fail), du.resistance_steps(fields['save_resistance']))
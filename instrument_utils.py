@@ -0,0 +1,76 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Collection is per thread: a thread records only between its own start() and stop(). _active
+# counts the threads collecting, so while it is 0 an instrumented call costs one extra
+# function call and one global lookup.
+_active = 0
+_lock = threading.Lock()
+_local = threading.local()
+
+def is_enabled():
+    """Whether the calling thread is collecting."""
+    return getattr(_local, 'stats', None) is not None
+
+def start():
+    """Starts a fresh collection for the calling thread (e.g. one Streamlit rerun)."""
+    global _active
+    with _lock:
+        if not is_enabled(): _active += 1
+        _local.stats = {}
+
+def stop():
+    """Stops collecting on the calling thread and returns what was recorded."""
+    global _active
+    rows = snapshot()
+    with _lock:
+        if is_enabled(): _active -= 1
+        _local.stats = None
+    return rows
+
+def snapshot():
+    """Per-name call count, total and max wall time (ms) and largest PMF support, slowest first."""
+    stats = getattr(_local, 'stats', None) or {}
+    rows = [{'name': name, 'calls': calls, 'total_ms': total * 1e3, 'max_ms': longest * 1e3, 'max_support': support}
+            for name, (calls, total, longest, support) in stats.items()]
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+def record(name, seconds, support=None):
+    """Adds one timed call to the calling thread's collection, if it has one."""
+    stats = getattr(_local, 'stats', None) if _active else None
+    if stats is None: return
+    calls, total, longest, max_support = stats.get(name, (0, 0.0, 0.0, None))
+    if support is not None and (max_support is None or support > max_support): max_support = support
+    stats[name] = (calls + 1, total + seconds, max(longest, seconds), max_support)
+
+def _support_size(result):
+    """Support length of a PMF or DamageSweep result; None for anything else."""
+    probs = getattr(result, 'probs', None)
+    if probs is None: probs = getattr(result, 'pmfs', None)
+    return int(probs.shape[-1]) if probs is not None else None
+
+def instrumented(fn):
+    """Decorator recording fn's calls under 'module.name'. Times are inclusive of nested instrumented calls."""
+    name = f"{fn.__module__}.{fn.__qualname__}"
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _active or getattr(_local, 'stats', None) is None: return fn(*args, **kwargs)
+        start_time = time.perf_counter()
+        result = fn(*args, **kwargs)
+        record(name, time.perf_counter() - start_time, _support_size(result))
+        return result
+    return wrapper
+
+@contextmanager
+def phase(name):
+    """Times a block of code (e.g. an app rendering phase) under name."""
+    if not _active or getattr(_local, 'stats', None) is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start_time)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import dnd_utils as dndu
+import instrument_utils as iu
+
+# The Action Library tab's compute path, kept free of Streamlit so it can run headless.
+
+@iu.instrumented
+def compute_action_dprs(library):
+    """Average damage of every action in a library, from analytic moments."""
+    return {name: dndu.get_action_moments(params)[0] for name, params in library.items()}
+
+def order_action_names(action_dprs, search="", by_average=False, descending=False):
+    """Names from an action -> average damage dict that contain search (case-insensitive), sorted."""
+    search = search.lower()
+    names = [name for name in action_dprs if search in name.lower()]
+    return sorted(names, key=action_dprs.get if by_average else None, reverse=descending)
+
+def pmf_plot_arrays(pmf, max_points=None, trim=0.0):
+    """(damage, probability, P(damage >= x)) arrays over a PMF's possible outcomes, for charting.
+
+    trim drops outcomes in either tail holding less than that much probability in total.
+    Above max_points outcomes, every k-th is kept, so each plotted value is still exact.
+    """
+    possible = pmf.probs > 0
+    damage, probs = pmf.outcomes()[possible], pmf.probs[possible]
+    survival = np.cumsum(probs[::-1])[::-1]
+    if trim > 0:
+        kept = (np.cumsum(probs) >= trim) & (survival >= trim)
+        damage, probs, survival = damage[kept], probs[kept], survival[kept]
+    if max_points and len(damage) > max_points:
+        step = -(-len(damage) // max_points)
+        damage, probs, survival = damage[::step], probs[::step], survival[::step]
+    return damage, probs, survival
+
+def _action_pmf(name, params):
+    return dndu.get_action_distribution(params)
+
+@iu.instrumented
+def build_plot_df(selected, max_points=None, trim=0.0, action_pmf=_action_pmf):
+    """Damage / Probability / MinDamageProb / Action rows for every selected action's PMF.
+
+    action_pmf(name, params) supplies each PMF, e.g. a graph_utils.ActionGraph's action_pmf.
+    """
+    names, columns = [], []
+    for name, params in selected.items():
+        columns.append(pmf_plot_arrays(action_pmf(name, params), max_points, trim))
+        names.append(name)
+    damage, probs, survival = (np.concatenate(arrays) for arrays in zip(*columns))
+    lengths = [len(arrays[0]) for arrays in columns]
+    return pd.DataFrame({
+        "Damage": damage,
+        "Probability": probs,
+        "MinDamageProb": survival,
+        "Action": pd.Categorical(np.repeat(names, lengths), categories=names),
+    })
+
+def build_average_df(selected, action_pmf=_action_pmf):
+    """One row of average damage per selected action, for the chart's average lines."""
+    return pd.DataFrame({
+        "Action": list(selected),
+        "avg": [action_pmf(name, params).mean() for name, params in selected.items()],
+    })
@@ -0,0 +1,190 @@
+from collections import namedtuple
+from statistics import NormalDist
+import numpy as np
+import dice_utils as du
+import dnd_utils as dndu
+
+# Upper bound on the number of individual die rolls held in memory at once
+MAX_CHUNK_ROLLS = 2**22
+# Exact support size above which get_action_distribution_or_estimate switches to sampling
+EXACT_SUPPORT_LIMIT = 20000
+
+# pmf: empirical PMF; lower/upper: per-outcome Wilson confidence bounds aligned with pmf.probs
+MonteCarloResult = namedtuple('MonteCarloResult', ['pmf', 'lower', 'upper', 'mean', 'mean_ci', 'samples'])
+
+# --- Vectorized Samplers ---
+
+def _sample_term(term, size, rng):
+    """Draws size samples of a DiceTerm."""
+    rolls = {'straight': 1, 'advantage': 2, 'disadvantage': 2, 'elven accuracy': 3}[term.mode]
+    if term.sides <= 0: return np.zeros(size, dtype=np.int64)
+    faces = rng.integers(1, term.sides + 1, size=(rolls, size, term.count))
+    if term.reroll:
+        rerolled = faces <= term.reroll
+        faces[rerolled] = rng.integers(1, term.sides + 1, size=np.count_nonzero(rerolled))
+    if term.min_roll:
+        np.maximum(faces, term.min_roll, out=faces)
+    if term.keep is not None:
+        faces.sort(axis=-1)
+        faces = faces[..., :term.keep] if term.keep_lowest else faces[..., term.count - term.keep:]
+    totals = faces.sum(axis=-1)
+    return totals.min(axis=0) if term.mode == 'disadvantage' else totals.max(axis=0)
+
+def sample_compiled(compiled, size, rng):
+    """Draws size samples of a compiled DiceExpression."""
+    samples = np.full(size, compiled.constant, dtype=np.int64)
+    for sign, term in compiled.dice:
+        samples += sign * _sample_term(term, size, rng)
+    return samples
+
+def sample_expression(expression, size, rng):
+    return sample_compiled(du.compile_expression(expression), size, rng)
+
+def _sample_d20_roll(roll_string, roll_name, size, rng):
+    """Samples the d20 face and the total roll for a d20 roll string."""
+    compiled = du.compile_expression(roll_string)
+    for i, (sign, term) in enumerate(compiled.dice):
+        if sign > 0 and dndu.is_d20_term(term):
+            bonus = compiled._replace(dice=compiled.dice[:i] + compiled.dice[i+1:])
+            face = _sample_term(term, size, rng)
+            return face, face + sample_compiled(bonus, size, rng)
+    raise ValueError(f"{roll_name} string must contain a '1d20' term.")
+
+def _floor_and_resist(samples, resistance_type):
+    return du.transform_values(samples, ['floor', *du.resistance_steps(resistance_type)])
+
+def action_sampler(params):
+    """Returns a sampler(size, rng) drawing damage samples for a saved action's parameters dict."""
+    if params['action_type'] == "Dice Roll":
+        compiled = du.compile_expression(params['dice_roll_string'])
+        return lambda size, rng: sample_compiled(compiled, size, rng)
+
+    if params['action_type'] == "Attack Roll":
+        hit = du.compile_expression(params['dmg_string'])
+        crit_string = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
+        crit = du.compile_expression(crit_string) if crit_string else du._double_dice(hit)
+
+        def sample_attack(size, rng):
+            face, total = _sample_d20_roll(params['attack_roll_string'], "Attack roll", size, rng)
+            is_crit = face >= params['crit_range']
+            is_hit = ~is_crit & (face != 1) & (total >= params['enemy_ac'])
+            damage = np.where(is_crit, sample_compiled(crit, size, rng),
+                              np.where(is_hit, sample_compiled(hit, size, rng), params['dmg_on_miss']))
+            return _floor_and_resist(damage, params['enemy_resistance'])
+        return sample_attack
+
+    fail = du.compile_expression(params['fail_dmg_string'])
+    succ = du.compile_expression(params.get('succ_dmg_string')) if params['save_success_behavior'] == "Custom" else None
+
+    def sample_save(size, rng):
+        face, total = _sample_d20_roll(params['save_roll_string'], "Saving throw roll", size, rng)
+        succeeds = (face == 20) | (total >= params['save_dc'])
+        fail_damage = sample_compiled(fail, size, rng)
+        if params['has_evasion']:
+            damage = np.where(succeeds, 0, fail_damage // 2)
+        elif params['save_success_behavior'] == "Custom":
+            damage = np.where(succeeds, sample_compiled(succ, size, rng), fail_damage)
+        elif params['save_success_behavior'] == "Half Damage":
+            damage = np.where(succeeds, fail_damage // 2, fail_damage)
+        else:
+            damage = np.where(succeeds, 0, fail_damage)
+        return _floor_and_resist(damage, params['save_resistance'])
+    return sample_save
+
+# --- Estimation ---
+
+def estimate_pmf(sampler, samples=1_000_000, seed=None, rolls_per_sample=1, confidence=0.95):
+    """Estimates a PMF from any vectorized sampler(size, rng) -> int array.
+
+    Samples are drawn in chunks of at most MAX_CHUNK_ROLLS // rolls_per_sample and folded
+    into running counts, so memory stays bounded however many samples are requested. The
+    same seed always gives the same result.
+    """
+    rng = np.random.default_rng(seed)
+    chunk = max(1, MAX_CHUNK_ROLLS // max(rolls_per_sample, 1))
+    offset, counts = 0, np.zeros(0, dtype=np.int64)
+    remaining = samples
+    while remaining > 0:
+        draw = sampler(min(chunk, remaining), rng)
+        remaining -= len(draw)
+        lo, hi = int(draw.min()), int(draw.max())
+        if not len(counts):
+            offset, counts = lo, np.zeros(hi - lo + 1, dtype=np.int64)
+        elif lo < offset or hi >= offset + len(counts):
+            new_offset = min(lo, offset)
+            grown = np.zeros(max(hi, offset + len(counts) - 1) - new_offset + 1, dtype=np.int64)
+            grown[offset - new_offset:offset - new_offset + len(counts)] = counts
+            offset, counts = new_offset, grown
+        counts += np.bincount(draw - offset, minlength=len(counts))
+
+    n = int(counts.sum())
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    lower, upper = _wilson_interval(counts, n, z)
+    probs = counts / n
+    outcomes = np.arange(offset, offset + len(counts))
+    mean = float(np.dot(outcomes, probs))
+    std_error = np.sqrt(max(np.dot((outcomes - mean) ** 2, probs), 0) / n)
+    return MonteCarloResult(du.PMF(offset, probs), lower, upper, mean, (mean - z * std_error, mean + z * std_error), n)
+
+def _wilson_interval(counts, n, z):
+    """Wilson score interval for each outcome's probability; stays sensible for rare outcomes."""
+    p = counts / n
+    center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+    half_width = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+    return np.maximum(center - half_width, 0), np.minimum(center + half_width, 1)
+
+def _damage_expressions(params):
+    """Every compiled damage expression an action can roll, with the default crit doubled."""
+    if params['action_type'] == "Dice Roll":
+        return [du.compile_expression(params['dice_roll_string'])]
+    if params['action_type'] == "Attack Roll":
+        hit = du.compile_expression(params['dmg_string'])
+        crit_string = params.get('custom_crit_string') if params.get('use_custom_crit') else ""
+        crit = du.compile_expression(crit_string) if crit_string else du._double_dice(hit)
+        return [hit, crit, du.compile_expression(params['dmg_on_miss'])]
+    expressions = [du.compile_expression(params['fail_dmg_string']), du.compile_expression(0)]
+    if params['save_success_behavior'] == "Custom":
+        expressions.append(du.compile_expression(params.get('succ_dmg_string')))
+    return expressions
+
+def estimate_action_distribution(params, samples=1_000_000, seed=None, confidence=0.95):
+    """Monte Carlo estimate of a saved action's damage distribution."""
+    # Every expression is sampled for every draw, plus up to three d20s for Elven Accuracy
+    rolls = 3 * (1 + sum(term.count for e in _damage_expressions(params) for _, term in e.dice))
+    return estimate_pmf(action_sampler(params), samples, seed, rolls, confidence)
+
+def exact_support_size(params):
+    """Upper bound on the exact PMF's support size, from the expressions' supports alone."""
+    supports = [du.compiled_moments(e).support for e in _damage_expressions(params)]
+    width = max(hi for _, hi in supports) - min(lo for lo, _ in supports) + 1
+    resistance = params.get('enemy_resistance') or params.get('save_resistance') or "Neither"
+    return 2 * width if resistance == "Vulnerable" else width
+
+def get_action_distribution_or_estimate(params, samples=1_000_000, seed=0, support_limit=EXACT_SUPPORT_LIMIT):
+    """The exact PMF when its support is at most support_limit, otherwise a seeded Monte Carlo estimate."""
+    if exact_support_size(params) <= support_limit:
+        return dndu.get_action_distribution(params)
+    return estimate_action_distribution(params, samples, seed).pmf
+
+def compare_to_exact(params, samples=1_000_000, seed=0, confidence=0.95):
+    """Validates the exact engine against sampling: total variation, worst error and CI coverage."""
+    exact = dndu.get_action_distribution(params)
+    estimate = estimate_action_distribution(params, samples, seed, confidence)
+    offset, (exact_probs, estimated_probs) = du.stack_pmfs([exact, estimate.pmf])
+
+    # Outcomes never sampled get the interval of a zero count
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    lower, upper = _wilson_interval(np.zeros(len(exact_probs)), estimate.samples, z)
+    start = estimate.pmf.offset - offset
+    lower[start:start + len(estimate.lower)] = estimate.lower
+    upper[start:start + len(estimate.upper)] = estimate.upper
+
+    possible = exact_probs > 0
+    covered = (exact_probs >= lower) & (exact_probs <= upper)
+    return {
+        'total_variation': float(np.abs(exact_probs - estimated_probs).sum() / 2),
+        'max_abs_error': float(np.abs(exact_probs - estimated_probs).max()),
+        'ci_coverage': float(covered[possible].mean()),
+        'mean_exact': exact.mean(),
+        'mean_ci': estimate.mean_ci,
+    }
@@ -0,0 +1,99 @@
+import numpy as np
+import dice_utils as du
+import dnd_utils as dndu
+
+# Memory budget of a SequenceEngine's cached turn and round PMFs
+SEQUENCE_CACHE_BYTES = 32 * 2**20
+
+def kill_probabilities(round_pmfs, hp):
+    """P(a target with hp hit points is down by the end of each round), one damage PMF per round.
+
+    An absorbing Markov chain over damage taken so far: the state vector covers 0..hp-1
+    (target still standing) and any mass reaching hp is absorbed as a kill. Each round is
+    one convolution truncated at hp, so the cost is O(rounds * hp * support) no matter how
+    large the untruncated damage total would grow. Negative damage counts as none.
+    """
+    standing = np.zeros(max(hp, 1))
+    standing[0] = 1.0
+    killed = []
+    for pmf in round_pmfs:
+        pmf = du.floor_pmf_at_zero(pmf)
+        # Damage that is a kill on its own is absorbed at once, so the step stops at hp - 1
+        step = np.zeros(max(min(pmf.max_outcome + 1, hp), 0))
+        step[pmf.offset:] = pmf.probs[:max(len(step) - pmf.offset, 0)]
+        standing = du._convolve_arrays(standing, step)[:hp] if len(step) else np.zeros(hp)
+        killed.append(max(1.0 - standing.sum(), 0.0))
+    return np.array(killed)
+
+class SequenceEngine:
+    """Composes saved actions into turns and multi-round damage totals.
+
+    A turn is a list of (action params, count) pairs, e.g. [(attack, 2), (bonus_attack, 1)].
+    Every sub-result is cached: turn PMFs per prefix, so appending an action to a turn costs
+    one convolution, and round totals per round count, built by doubling, so extending a
+    sequence from n to n + 1 rounds also costs one convolution. The cache is bounded by
+    cache_bytes and drops the least recently used results; action PMFs come from
+    dndu.get_action_distribution and its own cache.
+
+    With epsilon > 0 every convolution prunes tails below epsilon (see du.prune_pmf), which
+    keeps long sequences' supports short; each result's error bounds the mass discarded.
+    """
+
+    def __init__(self, epsilon=0.0, cache_bytes=SEQUENCE_CACHE_BYTES):
+        self.epsilon = epsilon
+        self._cache = du.PMFCache(cache_bytes)
+
+    def clear(self):
+        self._cache.clear()
+
+    def cache_info(self):
+        return self._cache.info()
+
+    def action_pmf(self, params):
+        return dndu.get_action_distribution(params)
+
+    def turn_pmf(self, turn):
+        """PMF of the total damage of one turn."""
+        return self._turn_pmf(*self._turn_key(turn))
+
+    def rounds_pmf(self, turn, rounds):
+        """PMF of the total damage of the same turn repeated for a number of rounds."""
+        return self._rounds_pmf(*self._turn_key(turn), rounds)
+
+    def round_totals(self, turn, rounds):
+        """PMFs of the cumulative damage after each of rounds 1..rounds."""
+        key, actions = self._turn_key(turn)
+        return [self._rounds_pmf(key, actions, n) for n in range(1, rounds + 1)]
+
+    def kill_probabilities(self, turn, hp, rounds):
+        """P(the target is down by the end of round k), for k = 1..rounds of the same turn."""
+        return kill_probabilities([self.turn_pmf(turn)] * rounds, hp)
+
+    def _turn_key(self, turn):
+        """(hashable key, action params) of a turn's actions with a positive count."""
+        key, actions = [], []
+        for params, count in turn:
+            if count <= 0: continue
+            key.append((dndu.action_key(params), count))
+            actions.append(params)
+        return tuple(key), actions
+
+    def _turn_pmf(self, key, actions):
+        if not key: return du.PMF.point(0)
+        def compute():
+            repeated = du.autoconvolve_pmf(self.action_pmf(actions[-1]), key[-1][1], epsilon=self.epsilon)
+            return du.convolve_pmfs(self._turn_pmf(key[:-1], actions[:-1]), repeated, epsilon=self.epsilon)
+        return self._cache.get_or_compute(('turn', key), compute)
+
+    def _rounds_pmf(self, key, actions, rounds):
+        if rounds <= 0: return du.PMF.point(0)
+        if rounds == 1: return self._turn_pmf(key, actions)
+        def compute():
+            turn = self._turn_pmf(key, actions)
+            previous = self._cache.get(('rounds', key, rounds - 1))
+            if previous is not None:
+                return du.convolve_pmfs(previous, turn, epsilon=self.epsilon)
+            half = self._rounds_pmf(key, actions, rounds // 2)
+            pmf = du.convolve_pmfs(half, half, epsilon=self.epsilon)
+            return du.convolve_pmfs(pmf, turn, epsilon=self.epsilon) if rounds % 2 else pmf
+        return self._cache.get_or_compute(('rounds', key, rounds), compute)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import numpy as np
+import dice_utils as du
+import dnd_utils as dndu
+
+# A saved library is a directory holding:
+#   library.json  {"version", "engine", "actions": {name: params}, "index": {action hash: [offset, start, length]}}
+#   pmfs.npy      every indexed PMF's probabilities, concatenated into one float64 array
+# pmfs.npy is opened memory-mapped, so a PMF's pages are only read when it is used. "engine"
+# is the dndu.ENGINE_VERSION that computed the PMFs; under any other engine they are ignored.
+STORE_VERSION = 1
+LIBRARY_FILE = "library.json"
+PMF_FILE = "pmfs.npy"
+
+def action_hash(params):
+    """Stable hex digest of an action's content key; changes whenever its distribution would."""
+    return hashlib.sha1(repr(dndu.action_key(params)).encode()).hexdigest()
+
+class PMFStore:
+    """Read-only, memory-mapped PMFs of a saved library, looked up by action params."""
+
+    def __init__(self, index, probs):
+        self.index, self.probs = index, probs
+
+    @classmethod
+    def empty(cls):
+        return cls({}, np.zeros(0))
+
+    def get(self, params):
+        """The stored PMF for params, or None if it was never stored or the params have changed."""
+        entry = self.index.get(action_hash(params))
+        if entry is None: return None
+        offset, start, length = entry
+        return du.PMF(offset, np.asarray(self.probs[start:start + length]))
+
+    def __len__(self):
+        return len(self.index)
+
+def is_saved_library(data):
+    """Whether parsed JSON has the shape of a saved library.json rather than a plain name -> params library."""
+    return isinstance(data, dict) and {'version', 'actions', 'index'} <= data.keys() and isinstance(data['actions'], dict)
+
+def saved_actions(saved, path):
+    """The name -> params actions of a parsed library.json, after checking its version."""
+    if saved.get('version') != STORE_VERSION:
+        raise ValueError(f"Unsupported library version {saved.get('version')!r} in {path}")
+    return saved['actions']
+
+def saved_library_dir(path):
+    """The saved library directory a library.json path belongs to, or None if it has no PMFs beside it."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(path) == LIBRARY_FILE and os.path.exists(os.path.join(directory, PMF_FILE)):
+        return directory
+    return None
+
+def load_library(path):
+    """Returns (library, PMFStore) from a saved library directory; PMFs are paged in on use.
+
+    PMFs saved by a different engine version are not loaded, so the store comes back empty.
+    """
+    with open(os.path.join(path, LIBRARY_FILE)) as f:
+        saved = json.load(f)
+    actions = saved_actions(saved, path)
+    if saved.get('engine') != dndu.ENGINE_VERSION: return actions, PMFStore.empty()
+    # An empty array cannot be memory-mapped
+    probs = np.load(os.path.join(path, PMF_FILE), mmap_mode='r') if saved['index'] else np.zeros(0)
+    return actions, PMFStore(saved['index'], probs)
+
+def save_library(path, library, store=None):
+    """Writes a library and every action's PMF to a directory, replacing any previous save.
+
+    PMFs already in store (e.g. the one the library was loaded with) are copied rather than
+    recomputed; anything else goes through dndu.get_action_distribution. Files are written
+    to temporaries and renamed into place, so an open memory map of the old store stays valid.
+    Actions whose dice strings do not parse are saved without a PMF.
+    """
+    store = PMFStore.empty() if store is None else store
+    os.makedirs(path, exist_ok=True)
+    index, chunks, start = {}, [], 0
+    for params in library.values():
+        key = action_hash(params)
+        if key in index: continue
+        pmf = store.get(params)
+        try:
+            if pmf is None: pmf = dndu.get_action_distribution(params)
+        except ValueError:
+            continue
+        index[key] = [pmf.offset, start, len(pmf.probs)]
+        chunks.append(pmf.probs)
+        start += len(pmf.probs)
+
+    pmf_path, library_path = os.path.join(path, PMF_FILE), os.path.join(path, LIBRARY_FILE)
+    with open(pmf_path + ".tmp", 'wb') as f:
+        np.save(f, np.concatenate(chunks) if chunks else np.zeros(0))
+    with open(library_path + ".tmp", 'w') as f:
+        json.dump({'version': STORE_VERSION, 'engine': dndu.ENGINE_VERSION, 'actions': library, 'index': index}, f)
+    os.replace(pmf_path + ".tmp", pmf_path)
+    os.replace(library_path + ".tmp", library_path)